@@ -0,0 +1,51 @@
+'''Time compiled programs with and without the inline arithmetic paths.
+
+Run with `python -m bench.arith` from the repository root. Each sample is built
+twice, once with --no-fast-ops, and each build is run several times. The fast
+build should be quicker on anything that does a lot of int or float math.'''
+
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+SAMPLES = (
+  'samples/advanced/fib.rn',
+  'samples/loops.rn',
+)
+
+RUNS = 20
+
+
+def build(src, exe, *flags):
+  subprocess.check_call([sys.executable, '-m', 'rain', '-q', '-o', exe, src] + list(flags))
+
+
+def measure(exe):
+  start = time.perf_counter()
+  for _ in range(RUNS):
+    subprocess.check_call([exe], stdout=subprocess.DEVNULL)
+  return (time.perf_counter() - start) / RUNS
+
+
+def main():
+  print('{:<28} {:>10} {:>10} {:>8}'.format('sample', 'slow (ms)', 'fast (ms)', 'speedup'))
+
+  with tempfile.TemporaryDirectory() as tmp:
+    for src in SAMPLES:
+      name = os.path.splitext(os.path.basename(src))[0]
+      slow_exe = os.path.join(tmp, name + '.slow')
+      fast_exe = os.path.join(tmp, name + '.fast')
+
+      build(src, slow_exe, '--no-fast-ops')
+      build(src, fast_exe)
+
+      slow = measure(slow_exe)
+      fast = measure(fast_exe)
+      print('{:<28} {:>10.2f} {:>10.2f} {:>7.2f}x'.format(
+        src, slow * 1e3, fast * 1e3, slow / fast))
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,42 @@
+'''Time parsing long chains of binary operators.
+
+Run with `python -m bench.binexpr` from the repository root. The time per
+operator should stay roughly constant as the chains grow.'''
+
+import rain.lexer as L
+import rain.parser as P
+import tempfile
+import time
+
+SIZES = (1000, 2500, 5000, 10000)
+
+CHAINS = {
+  'concat': ('"x"', ' $ '),
+  'cond': ('a == b', ' & '),
+  'mixed': ('a * 2', ' + '),
+}
+
+
+def source(item, op, count):
+  return 'var x = {}\n'.format(op.join([item] * (count + 1)))
+
+
+def measure(src, file):
+  start = time.perf_counter()
+  P.program(P.context(L.stream(src), file=file))
+  return time.perf_counter() - start
+
+
+def main():
+  print('{:<8} {:>8} {:>10} {:>12}'.format('chain', 'ops', 'time (s)', 'us / op'))
+
+  with tempfile.NamedTemporaryFile('w', suffix='.rn') as tmp:
+    for name, (item, op) in CHAINS.items():
+      for count in SIZES:
+        elapsed = measure(source(item, op, count), tmp.name)
+        print('{:<8} {:>8} {:>10.3f} {:>12.2f}'.format(
+          name, count, elapsed, elapsed / count * 1e6))
+
+
+if __name__ == '__main__':
+  main()
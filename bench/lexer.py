@@ -0,0 +1,45 @@
+'''Time the lexer over generated sources of increasing size.
+
+Run with `python -m bench.lexer` from the repository root. The time per line
+should stay roughly constant as the files grow.'''
+
+import rain.lexer as L
+import time
+
+BLOCK = '''# a generated function
+var f{n} = func(a, b)
+  var total = 0
+  for i in range(a, b)
+    if i / 2 == 0
+      total = total + i * {n}
+    else
+      total = total - 1.5
+  return [total, "done {n}", null, table]
+
+'''
+
+SIZES = (10000, 25000, 50000, 100000)
+
+
+def source(lines):
+  block_lines = BLOCK.count('\n')
+  return ''.join(BLOCK.format(n=n) for n in range(lines // block_lines))
+
+
+def measure(src):
+  start = time.perf_counter()
+  count = sum(1 for token in L.stream(src))
+  return time.perf_counter() - start, count
+
+
+def main():
+  print('{:>8} {:>10} {:>10} {:>12}'.format('lines', 'tokens', 'time (s)', 'us / line'))
+  for lines in SIZES:
+    src = source(lines)
+    elapsed, count = measure(src)
+    print('{:>8} {:>10} {:>10.3f} {:>12.2f}'.format(
+      lines, count, elapsed, elapsed / lines * 1e6))
+
+
+if __name__ == '__main__':
+  main()
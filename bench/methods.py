@@ -0,0 +1,36 @@
+'''Time compiled programs with and without inline caches for method calls.
+
+Run with `python -m bench.methods` from the repository root. Each sample is
+built twice, once with --no-inline-caches, and each build is run several
+times. Code that calls inherited methods a lot should be quicker with caches.'''
+
+from .arith import build, measure
+import os
+import tempfile
+
+SAMPLES = (
+  'samples/advanced/oo.rn',
+  'samples/mro.rn',
+)
+
+
+def main():
+  print('{:<28} {:>10} {:>10} {:>8}'.format('sample', 'slow (ms)', 'fast (ms)', 'speedup'))
+
+  with tempfile.TemporaryDirectory() as tmp:
+    for src in SAMPLES:
+      name = os.path.splitext(os.path.basename(src))[0]
+      slow_exe = os.path.join(tmp, name + '.slow')
+      fast_exe = os.path.join(tmp, name + '.fast')
+
+      build(src, slow_exe, '--no-inline-caches')
+      build(src, fast_exe)
+
+      slow = measure(slow_exe)
+      fast = measure(fast_exe)
+      print('{:<28} {:>10.2f} {:>10.2f} {:>7.2f}x'.format(
+        src, slow * 1e3, fast * 1e3, slow / fast))
+
+
+if __name__ == '__main__':
+  main()
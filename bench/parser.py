@@ -0,0 +1,42 @@
+'''Measure the memory used to parse a large generated source.
+
+Run with `python -m bench.parser` from the repository root. This reports the
+peak memory while parsing and the memory still held afterwards by the AST and
+the parser context.'''
+
+from bench.lexer import source
+import rain.lexer as L
+import rain.parser as P
+import sys
+import tempfile
+import time
+import tracemalloc
+
+LINES = 50000
+
+
+def main():
+  lines = int(sys.argv[1]) if len(sys.argv) > 1 else LINES
+  src = source(lines)
+
+  with tempfile.NamedTemporaryFile('w', suffix='.rn') as tmp:
+    tmp.write(src)
+    tmp.flush()
+
+    tracemalloc.start()
+    start = time.perf_counter()
+
+    ctx = P.context(L.stream(src), file=tmp.name)
+    ast = P.program(ctx)
+
+    elapsed = time.perf_counter() - start
+    held, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+  print('{} lines parsed in {:.3f} s'.format(lines, elapsed))
+  print('peak memory: {:>10.1f} KB'.format(peak / 1024))
+  print('held memory: {:>10.1f} KB'.format(held / 1024))
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,57 @@
+'''Time string-keyed table operations in a compiled program.
+
+Run with `python -m bench.tables` from the repository root. The program puts
+and gets the same set of string keys over and over, so the time per operation
+is mostly hashing and comparing keys. Compare the output between commits to
+see the effect of a runtime change.'''
+
+from .arith import build, measure
+import os
+import tempfile
+
+ROUNDS = 20000
+KEYS = (8, 64, 512)
+
+SOURCE = '''var main = func()
+  var keys = table
+  var n = 0
+  while n < {keys}
+    keys[n] = "a fairly long table key, number " $ tostr(n)
+    n = n + 1
+
+  var tab = table
+  var val = null
+  var round = 0
+  while round < {rounds}
+    n = 0
+    while n < {keys}
+      tab[keys[n]] = n
+      val = tab[keys[n]]
+      n = n + 1
+
+    round = round + 1
+'''
+
+
+def main():
+  print('{:>6} {:>10} {:>10}'.format('keys', 'time (ms)', 'ns / op'))
+
+  with tempfile.TemporaryDirectory() as tmp:
+    for keys in KEYS:
+      rounds = ROUNDS * KEYS[0] // keys
+      src = os.path.join(tmp, 'tables{}.rn'.format(keys))
+      exe = os.path.join(tmp, 'tables{}'.format(keys))
+
+      with open(src, 'w') as f:
+        f.write(SOURCE.format(keys=keys, rounds=rounds))
+
+      build(src, exe)
+      elapsed = measure(exe)
+
+      # each round does a put and a get for every key
+      ops = rounds * keys * 2
+      print('{:>6} {:>10.2f} {:>10.1f}'.format(keys, elapsed * 1e3, elapsed / ops * 1e9))
+
+
+if __name__ == '__main__':
+  main()
@@ -1,6 +1,9 @@
+from . import backend as B
+from . import cache
 from . import compiler as C
 from . import error as Q
 from . import module as M
+from . import timing as Z
 import argparse
 import os.path
 import sys
@@ -14,6 +17,41 @@ parser.add_argument('--quiet', '-q', action='store_true',
                     help='Quiet the compiler.')
 parser.add_argument('--verbose', '-v', action='store_true',
                     help='Print extra output.')
+parser.add_argument('--cache', metavar='DIR', default=os.environ.get('RAINCACHE'),
+                    help='Directory to cache build products in.')
+parser.add_argument('--cache-size', metavar='MB', type=int, default=512,
+                    help='Maximum size of the build cache.')
+parser.add_argument('--jobs', '-j', metavar='N', type=int, default=1,
+                    help='Number of jobs to run at once: clang processes, parsing threads, '
+                         'and (with --cache) module builds.')
+parser.add_argument('--backend', choices=['clang', 'llvm'], default='clang',
+                    help='Link and optimize with clang or in memory with LLVM.')
+parser.add_argument('--runtime', choices=['ir', 'static', 'shared'], default='ir',
+                    help='Link the core runtime as IR or as a prebuilt library.')
+parser.add_argument('--build-runtime', action='store_true',
+                    help='Build the prebuilt core runtime libraries and exit.')
+parser.add_argument('-O', dest='opt', choices=['0', '1', '2', '3', 's'], default='2',
+                    help='Optimization level.')
+parser.add_argument('--pipeline', metavar='MODULE=NAME', action='append', default=[],
+                    help='Optimize a module with a named pipeline ({}).'
+                         .format(', '.join(sorted(B.pipelines))))
+parser.add_argument('--lto', action='store_true',
+                    help='Optimize the program and the runtime as a whole '
+                         '(implies --backend llvm).')
+parser.add_argument('--native', action='store_true',
+                    help='Tune the program and the runtime for the host CPU. The result '
+                         'may not run on other machines.')
+parser.add_argument('--no-fast-ops', dest='fast_ops', action='store_false',
+                    help='Call the runtime for every binary operator instead of inlining '
+                         'int and float cases.')
+parser.add_argument('--no-inline-caches', dest='inline_caches', action='store_false',
+                    help='Look up every method call in the runtime instead of caching it.')
+parser.add_argument('--trace', choices=['off', 'lite', 'full'], default='full',
+                    help='Record every operation, only calls, or nothing for panic traces.')
+
+parser.add_argument('--time-report', metavar='FORMAT', nargs='?', const='table',
+                    choices=['table', 'json'], default=None,
+                    help='Report the time and memory spent in each phase (table or json).')
 
 parser.add_argument('--lex', '-L', action='store_true',
                     help='Stop and output the results of lexing.')
@@ -23,6 +61,8 @@ parser.add_argument('--emit', '-S', action='store_true',
                     help='Stop and output the results of code generation.')
 parser.add_argument('--run', '-r', action='store_true',
                     help='Execute the compiled code.')
+parser.add_argument('--jit', '-J', action='store_true',
+                    help='Execute the code in-process without producing an executable.')
 parser.add_argument('--shared', '-s', action='store_true',
                     help='Only compile the main module into a .so file with no links.')
 
@@ -31,7 +71,14 @@ parser.add_argument('file', metavar='RAIN', type=str, default='.', nargs='?',
 parser.add_argument('links', metavar='LINK', type=str, nargs='*',
                     help='Extra files to link with.')
 
-args = parser.parse_args()
+# anything after -- is passed to the program when it's executed
+argv = sys.argv[1:]
+prog_args = []
+if '--' in argv:
+  prog_args = argv[argv.index('--') + 1:]
+  argv = argv[:argv.index('--')]
+
+args = parser.parse_args(argv)
 
 
 if 'RAINHOME' not in os.environ:
@@ -43,12 +90,39 @@ if 'RAINLIB' not in os.environ:
 if 'RAINBASE' not in os.environ:
   os.environ['RAINBASE'] = os.path.join(os.environ['RAINHOME'], 'base')
 
+C.Compiler.quiet = args.quiet
+C.Compiler.verbose = args.verbose
+C.Compiler.jobs = max(args.jobs, 1)
+
+if args.time_report:
+  Z.enable()
+
+if args.cache:
+  C.Compiler.cache = cache.Cache(args.cache, max_size=args.cache_size * 1024 * 1024)
+
+if args.build_runtime:
+  C.build_runtime(force=True)
+  sys.exit(0)
+
 src = M.find_rain(args.file, paths=['.'])
 if not src:
   Q.abort("Can't find module {!r}".format(args.file))
 
-C.Compiler.quiet = args.quiet
-C.Compiler.verbose = args.verbose
+C.Compiler.backend = 'llvm' if args.lto else args.backend
+C.Compiler.lto = args.lto
+C.Compiler.native = args.native
+C.Compiler.runtime = args.runtime
+C.Compiler.opt = args.opt
+C.Compiler.fast_ops = args.fast_ops
+C.Compiler.inline_caches = args.inline_caches
+C.Compiler.trace = args.trace
+
+for tmp in args.pipeline:
+  qname, _, name = tmp.partition('=')
+  if name not in B.pipelines:
+    Q.abort('Unknown pipeline {!r} for {!r}', name, qname)
+  C.Compiler.pipelines[qname] = name
+
 comp = C.get_compiler(src, target=args.output, main=not args.shared)
 
 if args.lib:
@@ -59,6 +133,8 @@ if args.links:
   for tmp in args.links:
     comp.links.add(tmp)
 
+status = 0
+
 if args.lex:
   comp.lex()
   comp.write()
@@ -71,11 +147,30 @@ elif args.emit:
   comp.emit()
   comp.write()
 
+elif args.jit:
+  status = comp.jit(prog_args)
+
 elif args.shared:
   comp.share()
 
 else:
   comp.compile()
 
-if args.run:
+if args.run and not args.jit:
   comp.run()
+
+if C.Compiler.cache and C.Compiler.verbose:
+  stats = C.Compiler.cache.stats()
+  C.Compiler.vprint('{:>10} {} hits, {} misses, {} evictions, {} entries, {} bytes', 'cache',
+                    stats['hits'], stats['misses'], stats['evictions'],
+                    stats['entries'], stats['size'])
+
+if args.time_report == 'json':
+  report = comp.qname + '.time.json'
+  Z.dump(report)
+  C.Compiler.print('{:>10} {}', 'timing', report)
+
+elif args.time_report:
+  print(Z.table())
+
+sys.exit(status)
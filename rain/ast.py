@@ -1,12 +1,17 @@
 from . import error as Q
+from . import token as K
 import camel
 import fixedint
+import marshal
 import struct
 
 registry = camel.CamelRegistry()
 machine = camel.Camel([registry])
 tag_registry = {}
 
+# bump this whenever the binary AST format changes
+PACK_MAGIC = b'RAST\x01'
+
 
 # Base classes
 
@@ -39,12 +44,18 @@ class node(metaclass=metanode):
   __version__ = 1
   __slots__ = ['_coords']
 
+  # positions are stored as indexes into the shared position table
   @property
   def coords(self):
-    return getattr(self, '_coords', None)
+    idx = getattr(self, '_coords', None)
+    if idx is None:
+      return None
+    return K.positions.get(idx)
 
   @coords.setter
   def coords(self, value):
+    if isinstance(value, K.coord):
+      value = K.positions.add_coord(value)
     self._coords = value
 
   def emit(self, module):
@@ -341,9 +352,10 @@ class str_node(value_node, literal_node):
   __tag__ = 'str'
 
   def hash(self):
+    # djb2 over the UTF-8 bytes, the same as rain_hash_str in the runtime
     val = fixedint.MutableUInt64(5381)
-    for char in self.value:
-      val += (val * 32) + ord(char)
+    for byte in self.value.encode('utf-8'):
+      val += (val * 32) + byte
     return int(val)
 
 
@@ -463,3 +475,55 @@ class hint_node(node):
 
   def __init__(self, msg):
     self.msg = msg
+
+
+# Binary serialization
+
+def pack(node):
+  '''Serialize an AST into a compact binary format.'''
+  return PACK_MAGIC + marshal.dumps(pack_value(node))
+
+
+def unpack(data):
+  '''Load an AST that was serialized with pack().'''
+  if not data.startswith(PACK_MAGIC):
+    raise ValueError('Not a packed AST')
+
+  return unpack_value(marshal.loads(data[len(PACK_MAGIC):]))
+
+
+# nodes become (tag, coords, *slots) and plain tuples become (None, *items)
+def pack_value(val):
+  if isinstance(val, node):
+    coords = val.coords
+    if coords is not None:
+      coords = (coords.line, coords.col, coords.file, coords.len)
+
+    slots = [pack_value(getattr(val, slot)) for slot in type(val).__slots__]
+    return (val.__tag__, coords) + tuple(slots)
+
+  elif isinstance(val, list):
+    return [pack_value(item) for item in val]
+
+  elif isinstance(val, tuple):
+    return (None,) + tuple(pack_value(item) for item in val)
+
+  return val
+
+
+def unpack_value(val):
+  if isinstance(val, list):
+    return [unpack_value(item) for item in val]
+
+  elif isinstance(val, tuple):
+    if val[0] is None:
+      return tuple(unpack_value(item) for item in val[1:])
+
+    cls = tag_registry[val[0]]
+    new = cls(*(unpack_value(item) for item in val[2:]))
+    if val[1] is not None:
+      new.coords = K.coord(*val[1])
+
+    return new
+
+  return val
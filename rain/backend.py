@@ -0,0 +1,143 @@
+import llvmlite.binding as llvm
+
+initialized = False
+
+# named optimization pipelines that can be selected per build or per module
+pipelines = {
+  'O0': {'opt_level': 0},
+  'O1': {'opt_level': 1},
+  'O2': {'opt_level': 2},
+  'O3': {'opt_level': 3},
+  'Os': {'opt_level': 2, 'size_level': 1},
+  'hot': {'opt_level': 3, 'inline': 1000},
+}
+
+
+def initialize():
+  global initialized
+  if initialized:
+    return
+  initialized = True
+
+  llvm.initialize()
+  llvm.initialize_native_target()
+  llvm.initialize_native_asmprinter()
+
+
+class Backend:
+  '''Link, optimize, and emit LLVM modules in memory.
+
+  This replaces the clang round-trip of writing textual IR and having clang
+  parse and optimize it again. The system linker is still needed to link the
+  final object against shared libraries.'''
+
+  def __init__(self, opt_level=2, size_level=0, inline=None, pic=False, native=False):
+    initialize()
+
+    self.opt_level = opt_level
+    self.size_level = size_level
+    self.inline = inline
+    self.pic = pic
+
+    # clang tags its functions with the CPU it compiled for, and LLVM won't
+    # inline a function into a caller that has fewer features than it does,
+    # so this has to be native exactly when clang gets -march=native
+    cpu = ''
+    features = ''
+    if native:
+      cpu = llvm.get_host_cpu_name()
+      features = llvm.get_host_cpu_features().flatten()
+
+    target = llvm.Target.from_default_triple()
+    self.target_machine = target.create_target_machine(
+      cpu=cpu,
+      features=features,
+      opt=opt_level,
+      reloc='pic' if pic else 'default',
+      codemodel='default',
+    )
+
+  # Modules ###################################################################
+
+  def load_ir(self, llvm_ir, name=''):
+    '''Create an LLVM module from IR'''
+    mod = llvm.parse_assembly(llvm_ir)
+    mod.verify()
+    if name:
+      mod.name = name
+    return mod
+
+  def load_file(self, ll_file):
+    '''Create an LLVM module from a file'''
+    with open(ll_file) as tmp:
+      return self.load_ir(tmp.read(), name=ll_file)
+
+  def link(self, main, *files):
+    '''Link a main IR file and any number of other IR files into one module'''
+    mod = self.load_file(main)
+    for file in files:
+      mod.link_in(self.load_file(file))
+
+    mod.triple = self.target_machine.triple
+    mod.data_layout = str(self.target_machine.target_data)
+    return mod
+
+  def internalize(self, mod, keep=('main',)):
+    '''Give internal linkage to every definition except those in keep
+
+    This lets the optimizer inline, specialize, and drop anything that can't
+    be reached from the kept symbols.'''
+    for value in list(mod.functions) + list(mod.global_variables):
+      if value.is_declaration or value.name in keep:
+        continue
+
+      value.linkage = 'internal'
+
+    return mod
+
+  # Optimization ##############################################################
+
+  def pass_manager(self):
+    '''Create a module pass manager for the configured optimization level'''
+    pmb = llvm.create_pass_manager_builder()
+    pmb.opt_level = self.opt_level
+    pmb.size_level = self.size_level
+
+    if self.inline is not None:
+      pmb.inlining_threshold = self.inline
+    elif self.size_level:
+      pmb.inlining_threshold = 75
+    elif self.opt_level >= 2:
+      pmb.inlining_threshold = 225 if self.opt_level == 2 else 275
+
+    if self.opt_level >= 2 and not self.size_level:
+      pmb.loop_vectorize = True
+      pmb.slp_vectorize = True
+
+    pm = llvm.create_module_pass_manager()
+    self.target_machine.add_analysis_passes(pm)
+    pmb.populate(pm)
+    return pm
+
+  def optimize_ir(self, llvm_ir, name=''):
+    '''Optimize some IR and return the optimized IR'''
+    mod = self.load_ir(llvm_ir, name=name)
+    mod.triple = self.target_machine.triple
+    mod.data_layout = str(self.target_machine.target_data)
+    return str(self.optimize(mod))
+
+  def optimize(self, mod):
+    '''Run the optimization pipeline over a module'''
+    if self.opt_level or self.size_level:
+      self.pass_manager().run(mod)
+
+    return mod
+
+  # Emission ##################################################################
+
+  def emit_object(self, mod, target):
+    '''Write a module to an object file'''
+    with open(target, 'wb') as tmp:
+      tmp.write(self.target_machine.emit_object(mod))
+
+    return target
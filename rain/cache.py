@@ -0,0 +1,285 @@
+from os.path import join
+import hashlib
+import json
+import os
+import os.path
+import shutil
+import sys
+import tempfile
+import threading
+
+# bump this whenever the layout of the cache directory changes
+LAYOUT = 1
+
+DEFAULT_SIZE = 512 * 1024 * 1024
+
+
+def digest(*parts):
+  '''Hash a sequence of strings and bytes into a hex digest.'''
+  sha = hashlib.sha256()
+  for part in parts:
+    if isinstance(part, str):
+      part = part.encode('utf-8')
+    sha.update(part)
+    sha.update(b'\0')
+
+  return sha.hexdigest()
+
+
+def tree_size(path):
+  total = 0
+  for root, dirs, files in os.walk(path):
+    for name in files:
+      total += os.path.getsize(join(root, name))
+
+  return total
+
+
+class Cache:
+  '''A content-addressed, size-bounded cache of build products.
+
+  Entries are keyed by a hash of everything that can influence them: the
+  compiler itself, the contents of RAINLIB and RAINBASE, the source file, and
+  the keys of every module it imports (transitively).'''
+
+  def __init__(self, path, max_size=DEFAULT_SIZE):
+    self.path = os.path.abspath(path)
+    self.max_size = max_size
+
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+
+    # the total size of the entries, kept up to date by put_data() so that the
+    # entries only have to be walked when something needs to be evicted
+    self._size = None
+
+    # every entry this build has read or written, which eviction leaves alone
+    # so that one module's products can't push out another's mid-build
+    self.pinned = set()
+
+    # entries may be read and written from several clang jobs at once
+    self.lock = threading.RLock()
+
+    self.hashes = {}
+    self.keys = {}
+    self._fingerprint = None
+
+    os.makedirs(join(self.path, 'deps'), exist_ok=True)
+    os.makedirs(join(self.path, 'entries'), exist_ok=True)
+
+  def __str__(self):
+    return 'Cache {!r}'.format(self.path)
+
+  def __repr__(self):
+    return '<{!s}>'.format(self)
+
+  # Hashing ###################################################################
+
+  def file_hash(self, file):
+    '''Hash the contents of a file. Results are memoized per process.'''
+    file = os.path.abspath(file)
+    if file not in self.hashes:
+      with open(file, 'rb') as tmp:
+        self.hashes[file] = digest(tmp.read())
+
+    return self.hashes[file]
+
+  def tree_hash(self, path):
+    '''Hash the names and contents of every file in a directory.'''
+    parts = []
+    for root, dirs, files in os.walk(path):
+      dirs[:] = sorted(d for d in dirs if d != '__pycache__')
+      for name in sorted(files):
+        if name.endswith('.pyc'):
+          continue
+
+        file = join(root, name)
+        parts.append(os.path.relpath(file, path))
+        parts.append(self.file_hash(file))
+
+    return digest(*parts)
+
+  @property
+  def fingerprint(self):
+    '''Hash the compiler and the standard libraries.'''
+    if self._fingerprint is None:
+      here = os.path.dirname(os.path.abspath(__file__))
+      sources = sorted(name for name in os.listdir(here) if name.endswith('.py'))
+
+      self._fingerprint = digest(
+        str(LAYOUT), sys.version,
+        *[self.file_hash(join(here, name)) for name in sources],
+        self.tree_hash(os.environ['RAINLIB']),
+        self.tree_hash(os.environ['RAINBASE']),
+      )
+
+    return self._fingerprint
+
+  def digest(self, *parts):
+    '''Hash some parts along with the compiler fingerprint.'''
+    return digest(self.fingerprint, *parts)
+
+  # Dependencies ##############################################################
+
+  def deps_path(self, file):
+    file = os.path.abspath(file)
+    return join(self.path, 'deps', digest(file, self.file_hash(file)) + '.json')
+
+  def get_deps(self, file):
+    '''Return the recorded imports, links, and libraries of a source file.'''
+    try:
+      with open(self.deps_path(file)) as tmp:
+        return json.load(tmp)
+    except (OSError, ValueError):
+      return None
+
+  def set_deps(self, file, imports=(), links=(), libs=()):
+    '''Record the imports, links, and libraries of a source file.'''
+    data = {
+      'imports': sorted(os.path.abspath(x) for x in imports),
+      'links': sorted(os.path.abspath(x) for x in links),
+      'libs': sorted(libs),
+    }
+
+    self.write(self.deps_path(file), json.dumps(data).encode('utf-8'))
+
+  def key(self, file, *extra, seen=()):
+    '''Compute the cache key for a source file.
+
+    Returns None if the dependencies of the file (or of anything it imports)
+    haven't been recorded yet.'''
+    file = os.path.abspath(file)
+    if (file, extra) in self.keys:
+      return self.keys[file, extra]
+
+    if file in seen:  # circular import - don't even try
+      return None
+
+    deps = self.get_deps(file)
+    if deps is None:
+      return None
+
+    parts = [file, self.file_hash(file)]
+    parts.extend(str(x) for x in extra)
+
+    for imp in deps['imports']:
+      imp_key = self.key(imp, seen=seen + (file,))
+      if imp_key is None:
+        return None
+      parts.append(imp_key)
+
+    for link in deps['links']:
+      parts.append(self.file_hash(link))
+
+    parts.extend(deps['libs'])
+
+    self.keys[file, extra] = self.digest(*parts)
+    return self.keys[file, extra]
+
+  # Entries ###################################################################
+
+  def entry_path(self, key):
+    return join(self.path, 'entries', key)
+
+  def get(self, key, name):
+    '''Return the path of a cached file, or None if it isn't cached.'''
+    with self.lock:
+      if key is None:
+        self.misses += 1
+        return None
+
+      entry = self.entry_path(key)
+      path = join(entry, name)
+
+      if not os.path.isfile(path):
+        self.misses += 1
+        return None
+
+      self.hits += 1
+      self.pinned.add(entry)
+      self.touch(entry)
+      return path
+
+  def put(self, key, name, src):
+    '''Copy a file into the cache and return its new path.'''
+    with open(src, 'rb') as tmp:
+      return self.put_data(key, name, tmp.read())
+
+  def put_data(self, key, name, data):
+    '''Write some data into the cache and return its path.'''
+    entry = self.entry_path(key)
+    path = join(entry, name)
+
+    with self.lock:
+      size = self.size  # before the write, or a first walk would count it
+      os.makedirs(entry, exist_ok=True)
+      old_size = os.path.getsize(path) if os.path.isfile(path) else 0
+      self.write(path, data)
+
+      self.pinned.add(entry)
+      self.touch(entry)
+      self._size = size + len(data) - old_size
+      if self._size > self.max_size:
+        self.evict()
+
+      return path
+
+  def write(self, path, data):
+    '''Atomically write some data to a file.'''
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    with os.fdopen(fd, 'wb') as tmp:
+      tmp.write(data)
+
+    os.replace(tmp_path, path)
+
+  def touch(self, entry):
+    try:
+      os.utime(entry)
+    except OSError:
+      pass
+
+  @property
+  def size(self):
+    '''Return the total size of the entries, walking them the first time.'''
+    if self._size is None:
+      self._size = tree_size(join(self.path, 'entries'))
+
+    return self._size
+
+  def evict(self):
+    '''Remove the least recently used entries until the cache fits.
+
+    Entries pinned by this build are never removed, so the cache can stay
+    over its size until the next build.'''
+    root = join(self.path, 'entries')
+    entries = []
+    total = 0
+
+    for key in os.listdir(root):
+      entry = join(root, key)
+      size = tree_size(entry)
+      total += size
+
+      if entry not in self.pinned:
+        entries.append((os.path.getmtime(entry), size, entry))
+
+    entries.sort()
+    while entries and total > self.max_size:
+      mtime, size, entry = entries.pop(0)
+      shutil.rmtree(entry, ignore_errors=True)
+      self.evictions += 1
+      total -= size
+
+    # other processes may have written entries too, so resync with the walk
+    self._size = total
+
+  def stats(self):
+    '''Return some statistics about the cache.'''
+    return {
+      'hits': self.hits,
+      'misses': self.misses,
+      'evictions': self.evictions,
+      'entries': len(os.listdir(join(self.path, 'entries'))),
+      'size': self.size,
+    }
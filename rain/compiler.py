@@ -1,22 +1,50 @@
 from . import ast as A
+from . import backend as B
 from . import emit  # imported to apply decorations
+from . import engine as E
 from . import error as Q
+from . import fold as F
 from . import lexer as L
 from . import module as M
 from . import parser as P
+from . import timing as Z
+from . import token as K
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import Future
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError
+from concurrent.futures import wait as wait_any
 from contextlib import contextmanager
 from orderedset import OrderedSet
 from os import environ as ENV
 from os.path import join
 from termcolor import colored as X
+import fcntl
+import gc
+import multiprocessing
 import os.path
+import queue
 import subprocess
 import sys
 import tempfile
+import threading
 import traceback
+import weakref
 
 compilers = {}
-c_files = {}
+live_compilers = weakref.WeakSet()  # including ones dropped by reset_compilers()
+c_files = {}  # maps link sources to futures of their compiled targets
+c_lock = threading.Lock()
+pool = None
+runtime_lock = threading.Lock()
+
+compilers_lock = threading.RLock()
+parse_pool = None
+parse_lock = threading.Lock()
+waiting = {}   # maps threads to the thread they're waiting on to parse a module
+serving = []   # threads whose tasks are running on the main thread
+main_tasks = queue.Queue()
 
 
 # USE THIS to get a new compiler. it fuzzy searches for the source file and
@@ -24,44 +52,241 @@ c_files = {}
 def get_compiler(src, target=None, main=False):
   abspath = os.path.abspath(src)
 
-  if abspath not in compilers:
-    compilers[abspath] = Compiler(abspath, target, main)
+  with compilers_lock:
+    if abspath not in compilers:
+      compilers[abspath] = Compiler(abspath, target, main)
+      live_compilers.add(compilers[abspath])
+
+    return compilers[abspath]
+
+
+def get_pool():
+  '''Return the executor used to run clang jobs in the background.'''
+  global pool
+  if pool is None:
+    pool = ThreadPoolExecutor(max_workers=Compiler.jobs)
+
+  return pool
+
+
+def get_parse_pool():
+  '''Return the executor used to parse imported modules in the background.
+
+  This is separate from the clang pool, because parsing threads can block on
+  each other and on the main thread.'''
+  global parse_pool
+  if parse_pool is None:
+    parse_pool = ThreadPoolExecutor(max_workers=Compiler.jobs)
+
+  return parse_pool
+
+
+def is_main_thread():
+  return threading.current_thread() is threading.main_thread()
+
+
+def on_main(func, *args):
+  '''Run a function on the main thread and return its result.
+
+  The JIT is only used from the main thread, so background parsers hand their
+  macro expansions over and wait for them. The main thread runs them whenever
+  it waits for a module to be parsed.'''
+  if is_main_thread():
+    return func(*args)
+
+  future = Future()
+  main_tasks.put((threading.get_ident(), future, func, args))
+
+  while True:
+    try:
+      return future.result(timeout=0.1)
+    except TimeoutError:
+      if not threading.main_thread().is_alive():
+        raise RuntimeError('The main thread exited during a macro expansion')
+
+
+def wait(future):
+  '''Wait for a future, running tasks for other threads if on the main thread.'''
+  if not is_main_thread():
+    return future.result()
+
+  future.add_done_callback(lambda done: main_tasks.put(None))
+  while not future.done():
+    task = main_tasks.get()
+    if task:
+      run_task(*task)
+
+  return future.result()
+
+
+def run_task(thread, future, func, args):
+  serving.append(thread)
+  try:
+    future.set_result(func(*args))
+  except BaseException as exc:
+    future.set_exception(exc)
+  finally:
+    serving.pop()
+
+
+def waits_on(thread):
+  '''Return the thread that a thread is blocked on, if any.'''
+  if thread in waiting:
+    return waiting[thread]
+  if thread in serving:
+    return threading.main_thread().ident
+
+
+def import_graph(main):
+  '''Parse everything that a module imports and return the import graph.
+
+  The graph maps each file to the files it imports. Modules that are already
+  built (like the core modules) or cached, and the module itself, are left
+  out.'''
+  graph = {}
+  todo = [main]
+  while todo:
+    comp = todo.pop()
+    if comp.file in graph:
+      continue
+
+    comp.parse()
+    base = os.path.dirname(comp.file)
+    deps = set()
+    for stmt in comp.ast.stmts:
+      if isinstance(stmt, A.import_node):
+        file = M.find_rain(stmt.name, paths=[base])
+        dep = file and get_compiler(file)
+        if dep and dep is not main and not dep.built and not dep.is_cached():
+          deps.add(dep.file)
+          todo.append(dep)
+
+    graph[comp.file] = deps
+
+  del graph[main.file]
+  return graph
+
+
+def build_imports(main):
+  '''Build the modules that a module imports in worker processes.
+
+  A module is built as soon as everything it imports is. Workers leave their
+  modules in the build cache, so the parent only has to load them.'''
+  graph = import_graph(main)
+  if len(graph) < 2:
+    return
+
+  # the workers start out with everything that's already been parsed
+  kwargs = {}
+  if sys.version_info >= (3, 7):
+    kwargs['mp_context'] = multiprocessing.get_context('fork')
+
+  done = set()
+  running = {}
+  with ProcessPoolExecutor(max_workers=Compiler.jobs, **kwargs) as procs:
+    while graph or running:
+      ready = [file for file, deps in graph.items() if deps <= done]
+
+      # an import cycle. one worker builds the whole cycle, like on one thread
+      if not ready and not running:
+        ready = [min(graph, key=lambda file: len(graph[file] - done))]
+
+      for file in ready:
+        running[procs.submit(build_worker, file)] = file
+        del graph[file]
+
+      finished, _ = wait_any(running, return_when=FIRST_COMPLETED)
+      for future in finished:
+        future.result()
+        done.add(running.pop(future))
+
+
+def build_worker(file):
+  '''Build one module in a worker process.'''
+  global pool, parse_pool, c_lock, compilers_lock, parse_lock, runtime_lock
 
-  return compilers[abspath]
+  # the parent's threads didn't survive the fork, and neither should any lock
+  # that one of them was holding
+  pool = parse_pool = None
+  c_lock = threading.Lock()
+  compilers_lock = threading.RLock()
+  parse_lock = threading.Lock()
+  runtime_lock = threading.Lock()
+  Compiler.jobs = 1
+
+  get_compiler(file).build()
+
+
+def cpu_flags():
+  '''Return the clang flags for the target CPU.'''
+  return ['-march=native'] if Compiler.native else []
 
 
 def compile_link(src):
-  if src.endswith('.ll') or src.endswith('.so'):
-    return src
+  return compile_link_async(src).result()
 
-  if src not in c_files:
-    if not src.endswith('.c'):
-      Q.warn('unknown file type: {}', src)
-      Q.warn('passing through clang anyway')
 
-    clang = os.getenv('CLANG', 'clang')
+def compile_link_async(src):
+  '''Start compiling a link file and return a future of its target.
 
-    src_mtime = os.path.getmtime(src)
-    tempdir = tempfile.gettempdir()
-    rn_mod, _ = M.find_name(src)
-    target = join(tempdir, rn_mod + '.c.ll')
-    make = True
+  With more than one job, clang runs in the background so that several link
+  files (and the emission of other modules) can proceed at the same time.'''
+  with c_lock:
+    if src not in c_files:
+      if Compiler.jobs > 1:
+        c_files[src] = get_pool().submit(make_link, src)
+      else:
+        c_files[src] = Future()
+        try:
+          c_files[src].set_result(make_link(src))
+        except Exception as exc:
+          c_files[src].set_exception(exc)
+
+    return c_files[src]
 
-    # if the target exists and is newer than the source, don't remake
-    if os.path.exists(target):
-      target_mtime = os.path.getmtime(target)
-      if target_mtime > src_mtime:
-        make = False
 
-    if make:
-      flags = ['-O2', '-S', '-emit-llvm', '-I' + os.environ['RAINLIB']]
+def make_link(src):
+  if src.endswith('.ll') or src.endswith('.so'):
+    return src
 
-      cmd = [clang, '-o', target, src] + flags
+  if not src.endswith('.c'):
+    Q.warn('unknown file type: {}', src)
+    Q.warn('passing through clang anyway')
+
+  clang = os.getenv('CLANG', 'clang')
+  flags = ['-O' + Compiler.opt, '-S', '-emit-llvm', '-I' + os.environ['RAINLIB']] + cpu_flags()
+
+  src_mtime = os.path.getmtime(src)
+  tempdir = tempfile.gettempdir()
+  rn_mod, _ = M.find_name(src)
+  target = join(tempdir, '{}.O{}{}.c.ll'.format(rn_mod, Compiler.opt,
+                                                '.native' if Compiler.native else ''))
+  make = True
+
+  # if the cache has this exact file compiled with these exact flags, use it
+  cache = Compiler.cache
+  if cache:
+    key = cache.digest(os.path.abspath(src), cache.file_hash(src), clang, *flags)
+    cached = cache.get(key, 'link.c.ll')
+    if cached:
+      target = cached
+      make = False
+
+  # if the target exists and is newer than the source, don't remake
+  elif os.path.exists(target):
+    target_mtime = os.path.getmtime(target)
+    if target_mtime > src_mtime:
+      make = False
+
+  if make:
+    cmd = [clang, '-o', target, src] + flags
+    with Z.phase(rn_mod, 'clang'):
       subprocess.check_call(cmd)
 
-    c_files[src] = target
+    if cache:
+      target = cache.put(key, 'link.c.ll', target)
 
-  return c_files[src]
+  return target
 
 
 def compile_so(libs):
@@ -79,7 +304,99 @@ def compile_so(libs):
     flags = ['-shared']
 
     cmd = [clang, '-o', target] + flags + libs
-    subprocess.check_call(cmd)
+    with Z.phase('lib' + libname, 'clang'):
+      subprocess.check_call(cmd)
+
+  return target
+
+
+def runtime_dir():
+  '''Return the directory that the prebuilt core runtime lives in.'''
+  if 'RAINRUNTIME' in ENV:
+    return ENV['RAINRUNTIME']
+
+  if Compiler.cache:
+    return join(Compiler.cache.path, 'runtime')
+
+  return join(tempfile.gettempdir(), 'rain-runtime')
+
+
+def runtime_sources():
+  '''Return every C source and header file in the core package.'''
+  sources = []
+  for root, dirs, files in os.walk(ENV['RAINLIB']):
+    for name in files:
+      if name.endswith('.c') or name.endswith('.h'):
+        sources.append(join(root, name))
+
+  return sorted(sources)
+
+
+def is_runtime_link(src):
+  '''Return True if a link file is part of the prebuilt core runtime.'''
+  core = os.path.abspath(ENV['RAINLIB']) + os.sep
+  return src.endswith('.c') and os.path.abspath(src).startswith(core)
+
+
+def runtime_lib(kind='shared'):
+  '''Return the path to the core runtime library, building it if needed.'''
+  build_runtime()
+  name = 'librain-core.so' if kind == 'shared' else 'librain-core.a'
+  return join(runtime_dir(), name)
+
+
+def build_runtime(force=False):
+  '''Build librain-core.a and librain-core.so from the core C files.'''
+  target = runtime_dir()
+  static = join(target, 'librain-core.a')
+  shared = join(target, 'librain-core.so')
+  stamp = join(target, 'flags')
+  sources = runtime_sources()
+
+  clang = os.getenv('CLANG', 'clang')
+  flags = ['-O' + Compiler.opt, '-c', '-fPIC', '-fcommon', '-I' + ENV['RAINLIB']] + cpu_flags()
+
+  # other threads and processes may be building into the same directory
+  os.makedirs(target, exist_ok=True)
+  with runtime_lock, open(join(target, 'lock'), 'w') as lock:
+    fcntl.flock(lock, fcntl.LOCK_EX)
+
+    # if both libraries are newer than every source and were built with the
+    # same flags, don't remake
+    if not force and os.path.exists(static) and os.path.exists(shared) and os.path.exists(stamp):
+      with open(stamp) as tmp:
+        same_flags = tmp.read() == ' '.join(flags)
+
+      lib_mtime = min(os.path.getmtime(static), os.path.getmtime(shared))
+      if same_flags and all(os.path.getmtime(src) < lib_mtime for src in sources):
+        return target
+
+    Compiler.print('{:>10} {}', 'runtime', X(target, 'green'))
+
+    objs = []
+    futures = []
+    for src in sources:
+      if not src.endswith('.c'):
+        continue
+
+      rel = os.path.relpath(src, ENV['RAINLIB'])
+      obj = join(target, rel.replace(os.sep, '.')[:-2] + '.o')
+      cmd = [clang, '-o', obj, src] + flags
+      futures.append(get_pool().submit(subprocess.check_call, cmd))
+      objs.append(obj)
+
+    for future in futures:
+      future.result()
+
+    if os.path.exists(static):
+      os.remove(static)
+    subprocess.check_call(['ar', 'rcs', static] + objs)
+
+    libs = ['-lgc', '-lunwind', '-lgcc_s', '-ldl']
+    subprocess.check_call([clang, '-shared', '-o', shared] + objs + libs)
+
+    with open(stamp, 'w') as tmp:
+      tmp.write(' '.join(flags))
 
   return target
 
@@ -87,13 +404,33 @@ def compile_so(libs):
 def reset_compilers():
   global compilers
   global c_files
-  compilers = {}
-  c_files = {}
+  with compilers_lock:
+    compilers = {}
+    c_files = {}
+
+    # the positions can go too, unless something still holds an old compiler
+    # and its AST. compilers and their parsers refer to each other, so it
+    # takes a collection to find out
+    if live_compilers:
+      gc.collect()
+    if not live_compilers:
+      K.positions.clear()
 
 
 class Compiler:
   quiet = False
   verbose = False
+  cache = None  # a cache.Cache to reuse build products between runs
+  jobs = 1      # number of clang processes, parsing threads and module builds at once
+  backend = 'clang'  # or 'llvm' to link and optimize in memory
+  lto = False        # internalize the whole program before optimizing it
+  native = False     # tune for the host CPU instead of a generic one
+  runtime = 'ir'     # or 'static' / 'shared' to use the prebuilt core runtime
+  opt = '2'          # optimization level: 0, 1, 2, 3, or s
+  pipelines = {}     # maps module qnames to named pipelines in backend.pipelines
+  fast_ops = True    # emit inline int and float paths for binary operators
+  inline_caches = True  # cache method lookups at each call site
+  trace = 'full'     # or 'lite' to only trace calls, or 'off' to use the native stack
 
   def __init__(self, file, target=None, main=False):
     self.file = file
@@ -107,10 +444,14 @@ class Compiler:
     self.libs = set()
 
     self.stream = None  # set after lexing
+    self.parser = None  # set after parsing, unless the AST was cached
     self.ast = None     # set after parsing
     self.mod = None     # set before emitting
     self.ll = None      # set after writing
 
+    self.parse_future = None  # set when parsing starts, on any thread
+    self.parse_thread = None
+
     self.readen = False  # read is the past tense of read, which is a method...
     self.lexed = False
     self.parsed = False
@@ -122,13 +463,14 @@ class Compiler:
 
   @classmethod
   def print(cls, msg, *args, end='\n'):
+    # one write per message, so lines from worker processes don't interleave
     if not cls.quiet:
-      print(msg.format(*args), end=end)
+      print(msg.format(*args) + end, end='', flush=True)
 
   @classmethod
   def vprint(cls, msg, *args, end='\n'):
     if cls.verbose:
-      print(msg.format(*args), end=end)
+      print(msg.format(*args) + end, end='', flush=True)
 
   @contextmanager
   def okay(self, tag, msg=''):
@@ -169,18 +511,95 @@ class Compiler:
       return
     self.lexed = True
 
-    self.stream = L.stream(self.src)
+    self.stream = Z.timed(self.qname, 'lex', L.stream(self.src))
+
+  def parse(self, wait=True):
+    '''Parse the token stream into an AST.
 
-  def parse(self):
-    '''Parse the token stream into an AST.'''
-    self.lex()
+    If another thread is already parsing the module, this waits for it to
+    finish, unless wait is False.'''
+    with parse_lock:
+      started = self.parse_future is not None
+      if not started:
+        self.parse_future = Future()
+        self.parse_thread = threading.get_ident()
+        self.parsed = True
 
-    if self.parsed:
+    if started:
+      if wait:
+        self.wait_parsed()
       return
-    self.parsed = True
 
-    self.parser = P.context(self.stream, file=self.file)
-    self.ast = P.program(self.parser)
+    try:
+      if not self.load_ast():
+        self.lex()
+
+        with Z.phase(self.qname, 'parse'):
+          self.parser = P.context(self.stream, file=self.file)
+          self.ast = P.program(self.parser)
+
+    except BaseException as exc:
+      self.parse_future.set_exception(exc)
+      raise
+
+    self.parse_future.set_result(None)
+
+  def wait_parsed(self):
+    '''Wait for another thread to finish parsing the module.'''
+    me = threading.get_ident()
+
+    with parse_lock:
+      # follow the threads that are waiting on each other. if that leads back
+      # here, this is an import cycle, and like a cycle on one thread, the
+      # module is used as far as it has been parsed
+      thread = self.parse_thread
+      seen = set()
+      while thread != me and thread not in seen and waits_on(thread):
+        seen.add(thread)
+        thread = waits_on(thread)
+
+      if thread == me:
+        return
+
+      outer = waiting.get(me)
+      waiting[me] = self.parse_thread
+
+    try:
+      wait(self.parse_future)
+    finally:
+      with parse_lock:
+        if outer:
+          waiting[me] = outer
+        else:
+          del waiting[me]
+
+  def prefetch(self):
+    '''Start parsing the module in the background.
+
+    With more than one job, imports are read, lexed and parsed on a pool as
+    soon as they're seen, while the importer keeps parsing.'''
+    if Compiler.jobs > 1 and self.parse_future is None:
+      get_parse_pool().submit(self.parse_prefetched)
+
+  def parse_prefetched(self):
+    if threading.main_thread().is_alive():
+      self.parse(wait=False)
+
+  @property
+  def macros(self):
+    '''Return the macros defined in or imported by the module.'''
+    self.parse()
+
+    if self.parser is None:
+      if self.ast is None:  # still being parsed earlier in an import cycle
+        return {}
+
+      # the AST came from the cache, so the macros have to be registered again
+      self.parser = P.context(iter([K.end_token()]), file=self.file)
+      P.load_macros(self.parser, self.ast)
+
+    self.parser.merge_imports()
+    return self.parser.macros
 
   def emit(self):
     '''Emit LLVM IR for the module.'''
@@ -190,44 +609,60 @@ class Compiler:
       return
     self.emitted = True
 
-    self.mod = M.Module(self.file)
-    self.mods.add(self.mod)
+    with Z.phase(self.qname, 'emit'):
+      self.mod = M.Module(self.file, tracing=Compiler.trace)
+      self.mods.add(self.mod)
+
+      # always link with lib/_pkg.rn
+      builtin = get_compiler(join(ENV['RAINLIB'], '_pkg.rn'))
+      if self is not builtin:  # unless we ARE lib/_pkg.rn
+        builtin.exports()
+        self.link_with(builtin)
+
+        # workers hand their modules back through the cache
+        if self.main and Compiler.jobs > 1 and Compiler.cache:
+          with Z.phase(self.qname, 'build imports'):
+            build_imports(self)
 
-    # always link with lib/_pkg.rn
-    builtin = get_compiler(join(ENV['RAINLIB'], '_pkg.rn'))
-    if self is not builtin:  # unless we ARE lib/_pkg.rn
-      builtin.build()
+        # import globals
+        self.mod.import_scope(builtin.mod)
+        self.mod.import_llvm(builtin.mod)
 
-      self.link_with(builtin)
+      with Z.phase(self.qname, 'fold'):
+        self.ast, folded = F.fold_tree(self.ast)
 
-      # import globals
-      self.mod.import_scope(builtin.mod)
-      self.mod.import_llvm(builtin.mod)
+      if folded:
+        self.vprint('{:>10} {} {} nodes', 'folded', X(self.qname, 'green'), folded)
 
-    # compile the imports
-    self.ast.emit(self.mod)
+      # compile the imports
+      self.ast.emit(self.mod)
 
-    for mod in self.mod.imports:
-      comp = get_compiler(mod)
-      self.vprint('           {} imports {}', X(self.qname, 'green'), X(comp.qname, 'blue'))
-      comp.build()  # should be done during import but might as well be safe
+      for mod in self.mod.imports:
+        comp = get_compiler(mod)
+        self.vprint('           {} imports {}', X(self.qname, 'green'), X(comp.qname, 'blue'))
+        comp.exports()  # should be done during import but might as well be safe
 
-      # add the module's IR as well as all of its imports' IR
-      self.link_with(comp)
-      self.mods.add(comp.mod)
+        # add the module's IR as well as all of its imports' IR
+        self.link_with(comp)
+        self.mods.add(comp.mod)
 
-    for link in self.mod.links:
-      self.vprint('           {} links {}', X(self.qname, 'green'), X(link, 'blue'))
+      for link in self.mod.links:
+        self.vprint('           {} links {}', X(self.qname, 'green'), X(link, 'blue'))
 
-    for lib in self.mod.libs:
-      self.vprint('           {} shares {}', X(self.qname, 'green'), X(lib, 'blue'))
+      for lib in self.mod.libs:
+        self.vprint('           {} shares {}', X(self.qname, 'green'), X(lib, 'blue'))
 
-    self.links |= self.mod.links
-    self.libs |= self.mod.libs
+      self.links |= self.mod.links
+      self.libs |= self.mod.libs
 
-    # only spit out the main if this is the main file
-    if self.main:
-      self.ast.emit_main(self.mod, mods=self.mods)
+      # start compiling link files now so they're ready by the time we need them
+      if Compiler.jobs > 1:
+        for link in self.mod.links:
+          compile_link_async(link)
+
+      # only spit out the main if this is the main file
+      if self.main:
+        self.ast.emit_main(self.mod, mods=self.mods)
 
   def write(self):
     '''Write data based on what the latest compilation step is.'''
@@ -238,8 +673,8 @@ class Compiler:
     if self.built:
       tempdir = tempfile.gettempdir()
       name = join(tempdir, self.qname + '.ll')
-      with open(name, 'w') as tmp:
-        tmp.write(self.mod.ir)
+      with Z.phase(self.qname, 'write'), open(name, 'w') as tmp:
+        tmp.write(self.optimized_ir())
 
       self.ll = name
 
@@ -257,6 +692,17 @@ class Compiler:
           tmp.write(str(token))
           tmp.write('\n')
 
+  def optimized_ir(self):
+    '''Return the module's IR after running its named pipeline, if any.'''
+    pipeline = Compiler.pipelines.get(self.qname)
+    if not pipeline:
+      return self.mod.ir
+
+    self.vprint('{:>10} {} with {}', 'optimizing', X(self.qname, 'green'), X(pipeline, 'yellow'))
+    with Z.phase(self.qname, 'pipeline'):
+      backend = B.Backend(**B.pipelines[pipeline])
+      return backend.optimize_ir(self.mod.ir, name=self.qname)
+
   def build(self):
     '''Emit code and write it to a file.'''
     if self.built:
@@ -267,17 +713,145 @@ class Compiler:
     if Compiler.verbose:
       msg = ' from {}'.format(X(self.file, 'blue'))
 
+    if self.load(msg=msg):
+      return
+
     with self.okay('building', msg=msg):
       self.emit()
       self.write()
+      self.store()
+
+  def exports(self):
+    '''Build the module and return it, ready to be imported.
+
+    A cached build brings the module's globals along with it, so the module
+    only has to be emitted again if they're missing from the cache.'''
+    self.build()
+    if not self.mod:
+      self.emit()
+
+    return self.mod
+
+  def cache_key(self):
+    '''Return the key of the module in the build cache.'''
+    if Compiler.cache:
+      pipeline = Compiler.pipelines.get(self.qname, '')
+      return Compiler.cache.key(self.file, 'main' if self.main else 'lib', pipeline,
+                                'fast' if Compiler.fast_ops else 'slow',
+                                'ic' if Compiler.inline_caches else 'noic',
+                                Compiler.trace)
+
+  def is_cached(self):
+    '''Return True if the build cache has everything needed to import the module.'''
+    key = self.cache_key()
+    return bool(key) and os.path.isfile(join(Compiler.cache.entry_path(key), 'module.exports'))
+
+  def load(self, msg=''):
+    '''Reuse a cached build of the module instead of building it.'''
+    if not Compiler.cache:
+      return False
+
+    key = self.cache_key()
+    ll = Compiler.cache.get(key, 'module.ll')
+    if not ll:
+      return False
+
+    with self.okay('cached', msg=msg), Z.phase(self.qname, 'cache'):
+      deps = Compiler.cache.get_deps(self.file)
+
+      # without the exported globals, exports() falls back to emitting. a
+      # circular import can get here while the module is still being emitted
+      path = not self.mod and Compiler.cache.get(key, 'module.exports')
+      if path:
+        with open(path, 'rb') as tmp:
+          self.mod = M.unpack_exports(tmp.read(), self.file)
+        self.mods.add(self.mod)
+
+      builtin = get_compiler(join(ENV['RAINLIB'], '_pkg.rn'))
+      if self is not builtin:
+        builtin.exports()
+        self.link_with(builtin)
+
+      for mod in deps['imports']:
+        comp = get_compiler(mod)
+        comp.exports()
+        self.link_with(comp)
+        self.mods.add(comp.mod)
+
+      self.links |= set(deps['links'])
+      self.libs |= set(deps['libs'])
+
+      if Compiler.jobs > 1:
+        for link in deps['links']:
+          compile_link_async(link)
+
+      # pretend we've already written the IR
+      self.ll = ll
+      self.written = True
+
+    return True
+
+  def store(self):
+    '''Save the built module in the build cache.'''
+    if not Compiler.cache:
+      return
+
+    Compiler.cache.set_deps(self.file, self.mod.imports, self.mod.links, self.mod.libs)
+
+    key = self.cache_key()
+    if key:
+      Compiler.cache.put(key, 'module.ll', self.ll)
+      Compiler.cache.put_data(key, 'module.exports', M.pack_exports(self.mod))
+
+    # now that the imports are known, the AST can be cached too
+    self.store_ast()
+
+  def load_ast(self):
+    '''Reuse a cached AST of the module instead of parsing it.
+
+    The AST depends on the macros of the imported modules, so it can only be
+    found once the imports have been recorded by a previous build.'''
+    if not Compiler.cache:
+      return False
+
+    path = Compiler.cache.get(Compiler.cache.key(self.file, 'ast'), 'module.ast')
+    if not path:
+      return False
+
+    with Z.phase(self.qname, 'load ast'):
+      try:
+        with open(path, 'rb') as tmp:
+          self.ast = A.unpack(tmp.read())
+      except (OSError, ValueError, EOFError):
+        return False
+
+    self.vprint('{:>10} {} from {}', 'loaded', X(self.qname, 'green'), X(path, 'blue'))
+    return True
+
+  def store_ast(self):
+    '''Save the AST of the module in the build cache.'''
+    if not Compiler.cache or not self.parsed:
+      return
+
+    key = Compiler.cache.key(self.file, 'ast')
+    if key and not os.path.exists(join(Compiler.cache.entry_path(key), 'module.ast')):
+      with Z.phase(self.qname, 'store ast'):
+        Compiler.cache.put_data(key, 'module.ast', A.pack(self.ast))
 
   def compile_links(self):
     '''Compile all additional link files into LLVM IR.'''
     drop = set()
     add = set()
 
-    for link in self.links:
-      target = compile_link(link)
+    # the prebuilt runtime replaces the core link files
+    if Compiler.runtime != 'ir':
+      drop = {link for link in self.links if is_runtime_link(link)}
+
+    # start every job before waiting on any of them
+    futures = [(link, compile_link_async(link)) for link in self.links - drop]
+
+    for link, future in futures:
+      target = future.result()
 
       if target != link:
         drop.add(link)
@@ -289,6 +863,24 @@ class Compiler:
     '''Compile all shared libraries into a .so file.'''
     return compile_so(self.libs)
 
+  def emit_object(self, *links, lto=False):
+    '''Link the module with some IR files in memory and emit an object file.'''
+    backend = B.Backend(pic=True, native=Compiler.native, **B.pipelines['O' + Compiler.opt])
+
+    with Z.phase(self.qname, 'llvm link'):
+      mod = backend.link(self.ll, *links)
+      if lto:
+        backend.internalize(mod, keep=('main',))
+
+    with Z.phase(self.qname, 'llvm optimize'):
+      backend.optimize(mod)
+
+    tempdir = tempfile.gettempdir()
+    target = join(tempdir, self.qname + '.o')
+    self.vprint('{:>10} {}', 'object', X(target, 'yellow'))
+    with Z.phase(self.qname, 'llvm object'):
+      return backend.emit_object(mod, target)
+
   def compile(self):
     '''Compile a full program into an executable.'''
     self.build()
@@ -307,9 +899,29 @@ class Compiler:
         target = target + '.out'
 
       clang = os.getenv('CLANG', 'clang')
-      flags = ['-O2']
+      flags = ['-O' + Compiler.opt] + cpu_flags()
       libs = ['-l' + lib for lib in self.libs]
-      cmd = [clang, '-o', target, self.ll] + flags + libs + list(self.links)
+
+      # panic traces come from the symbols of the native stack
+      if Compiler.trace == 'off':
+        libs.append('-rdynamic')
+
+      if Compiler.runtime == 'static':
+        libs = [runtime_lib('static')] + libs
+      elif Compiler.runtime == 'shared':
+        libdir = runtime_dir()
+        runtime_lib('shared')
+        libs = ['-L' + libdir, '-lrain-core', '-Wl,-rpath,' + libdir] + libs
+
+      if Compiler.backend == 'llvm':
+        # only IR can be linked in memory; objects go to the system linker
+        ir_links = [link for link in self.links if link.endswith('.ll')]
+        objs = [link for link in self.links if not link.endswith('.ll')]
+        obj = self.emit_object(*ir_links, lto=Compiler.lto)
+        flags = []
+        cmd = [clang, '-o', target, obj] + objs + libs
+      else:
+        cmd = [clang, '-o', target, self.ll] + flags + libs + list(self.links)
 
       self.vprint('{:>10} {}', 'target', X(target, 'yellow'))
       self.vprint('{:>10} {}', 'flags', X('  '.join(flags), 'yellow'))
@@ -320,7 +932,8 @@ class Compiler:
       for lib in libs:
         self.vprint('{:>10} {}', 'lib', X(lib, 'yellow'))
 
-      subprocess.check_call(cmd)
+      with Z.phase(self.qname, 'link'):
+        subprocess.check_call(cmd)
 
   def share(self):
     '''Compile a single Rain file into a shared object file.'''
@@ -335,14 +948,42 @@ class Compiler:
     with self.okay('sharing'):
       target = self.target or self.qname + '.so'
       clang = os.getenv('CLANG', 'clang')
-      flags = ['-O2', '-shared', '-fPIC']
-      cmd = [clang, '-o', target, self.ll] + flags
+      flags = ['-O' + Compiler.opt, '-shared', '-fPIC'] + cpu_flags()
+
+      if Compiler.backend == 'llvm':
+        obj = self.emit_object()
+        flags = ['-shared']
+        cmd = [clang, '-o', target, obj] + flags
+      else:
+        cmd = [clang, '-o', target, self.ll] + flags
 
       self.vprint('{:>10} {}', 'target', X(target, 'yellow'))
       self.vprint('{:>10} {}', 'flags', X('  '.join(flags), 'yellow'))
       self.vprint('{:>10} {}', 'src', X(self.ll, 'yellow'))
 
-      subprocess.check_call(cmd)
+      with Z.phase(self.qname, 'link'):
+        subprocess.check_call(cmd)
+
+  def jit(self, argv=()):
+    '''Execute a full program in-process without producing an executable.'''
+    self.build()
+    self.compile_links()
+
+    with self.okay('running'):
+      eng = E.Engine(cache=Compiler.cache)
+      if Compiler.runtime == 'ir':
+        eng.add_lib(self.compile_libs())
+      else:
+        eng.add_lib(runtime_lib('shared'))
+
+      eng.add_lib(*[link for link in self.links if link.endswith('.so')])
+      eng.add_file(self.ll, *[link for link in self.links if not link.endswith('.so')])
+
+      with Z.phase(self.qname, 'jit'):
+        eng.finalize()
+
+      sys.stdout.flush()
+      return eng.main([self.file] + list(argv))
 
   def run(self):
     '''Execute a generated executable.'''
@@ -12,6 +12,8 @@
 
 #define HASH_SIZE 32
 
+#define IC_DEPTH 4  // inline caches only cover this many metatables
+
 #define BOX_IS(x, t) ((x)->type == ITYP_##t)
 #define BOX_ISNT(x, t) ((x)->type != ITYP_##t)
 
@@ -32,6 +34,7 @@ typedef struct box_s {
   int size;
   cast data;
   struct box_s *env;
+  unsigned long hash;  // cached hash of a string, or 0 if it isn't known yet
 } box;
 
 typedef struct item_s {
@@ -43,8 +46,18 @@ typedef struct table_s {
   int cur;
   int max;
   item **items;
+  unsigned long version;  // bumped on every put, so inline caches can check it
 } table;
 
+// an inline cache remembers the metatables that a lookup went through, and
+// their versions at the time. depth is 0 until the cache has been filled
+typedef struct ic_s {
+  int depth;
+  table *metas[IC_DEPTH];
+  unsigned long versions[IC_DEPTH];
+  box val;
+} ic;
+
 int rain_box_to_exit(box *);
 void rain_check_callable(box *, int);
 int rain_has_meta(box *);
@@ -237,6 +237,11 @@ void rain_panic(box *val) {
 
   rain_set_box(&exception.val, val);
 
+  // with tracing off, this is the last chance to see where the panic was
+  if(rain_trace_depth == 0) {
+    rain_save_native_trace();
+  }
+
   _Unwind_RaiseException((unwind_exception_t *)&exception);
   abort();
 }
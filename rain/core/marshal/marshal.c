@@ -0,0 +1,301 @@
+#include "rain.h"
+#include <stdint.h>
+#include <stdlib.h>
+#include <string.h>
+
+
+// The compiler converts macro arguments and results with these functions, so
+// that a whole AST crosses between Python and Rain in a single call.
+//
+// A buffer is a sequence of records, each starting with a type byte:
+//
+//   ITYP_NULL
+//   ITYP_INT       int64
+//   ITYP_FLOAT     double
+//   ITYP_BOOL      uint8
+//   ITYP_STR       string
+//   MARSHAL_ARRAY  uint32 count, count records
+//   MARSHAL_NODE   string tag, uint32 count, count (string key, record) pairs
+//
+// where a string is a uint32 length followed by that many bytes. All numbers
+// are in native byte order.
+
+
+// unmarshal
+
+static char *read_str(box *ret, char *buf) {
+  uint32_t len;
+  memcpy(&len, buf, sizeof(len));
+  buf += sizeof(len);
+
+  rain_set_strcpy(ret, buf, len);
+  return buf + len;
+}
+
+static char *unmarshal_box(box *ret, char *buf, box *array_meta, box *ast_module) {
+  unsigned char type = *buf++;
+  uint32_t count;
+  box key;
+  box val;
+
+  switch(type) {
+    case ITYP_NULL:
+      rain_set_null(ret);
+      return buf;
+
+    case ITYP_INT: {
+      int64_t si;
+      memcpy(&si, buf, sizeof(si));
+      rain_set_int(ret, si);
+      return buf + sizeof(si);
+    }
+
+    case ITYP_FLOAT: {
+      double f;
+      memcpy(&f, buf, sizeof(f));
+      rain_set_float(ret, f);
+      return buf + sizeof(f);
+    }
+
+    case ITYP_BOOL:
+      rain_set_bool(ret, *buf);
+      return buf + 1;
+
+    case ITYP_STR:
+      return read_str(ret, buf);
+
+    case MARSHAL_ARRAY:
+      memcpy(&count, buf, sizeof(count));
+      buf += sizeof(count);
+
+      rain_set_table(ret);
+      for(uint32_t i=0; i<count; i++) {
+        rain_set_int(&key, i);
+        buf = unmarshal_box(&val, buf, array_meta, ast_module);
+        if(buf == NULL) {
+          return NULL;
+        }
+
+        rain_put_aux(ret, &key, &val, NULL);
+      }
+
+      ret->env = array_meta;
+      return buf;
+
+    case MARSHAL_NODE: {
+      box tag;
+      buf = read_str(&tag, buf);
+      box *meta = rain_get_ptr(ast_module, &tag);
+      if(meta == NULL) {
+        return NULL;
+      }
+
+      memcpy(&count, buf, sizeof(count));
+      buf += sizeof(count);
+
+      // fill the table before setting its metatable so that rain_put_aux
+      // doesn't need to look for a "set" method
+      rain_set_table(ret);
+      for(uint32_t i=0; i<count; i++) {
+        buf = read_str(&key, buf);
+        buf = unmarshal_box(&val, buf, array_meta, ast_module);
+        if(buf == NULL) {
+          return NULL;
+        }
+
+        rain_put_aux(ret, &key, &val, NULL);
+      }
+
+      ret->env = meta;
+      return buf;
+    }
+  }
+
+  return NULL;
+}
+
+int rain_unmarshal(box *ret, char *buf, box *array_meta, box *ast_module) {
+  return unmarshal_box(ret, buf, array_meta, ast_module) != NULL;
+}
+
+
+// marshal
+
+// once an allocation fails, data is NULL and every write is dropped
+typedef struct buffer {
+  char *data;
+  size_t len;
+  size_t cap;
+} buffer;
+
+static void write_raw(buffer *buf, const void *data, size_t len) {
+  if(buf->data == NULL) {
+    return;
+  }
+
+  if(buf->len + len > buf->cap) {
+    while(buf->len + len > buf->cap) {
+      buf->cap *= 2;
+    }
+
+    char *grown = realloc(buf->data, buf->cap);
+    if(grown == NULL) {
+      free(buf->data);
+      buf->data = NULL;
+      return;
+    }
+
+    buf->data = grown;
+  }
+
+  memcpy(buf->data + buf->len, data, len);
+  buf->len += len;
+}
+
+static void write_at(buffer *buf, size_t at, const void *data, size_t len) {
+  if(buf->data != NULL) {
+    memcpy(buf->data + at, data, len);
+  }
+}
+
+static void write_type(buffer *buf, unsigned char type) {
+  write_raw(buf, &type, 1);
+}
+
+static void write_str(buffer *buf, char *s) {
+  uint32_t len = strlen(s);
+  write_raw(buf, &len, sizeof(len));
+  write_raw(buf, s, len);
+}
+
+// find the field names of a node type. fields is a sequence of tags, each
+// followed by its field names and an empty string, with an empty string after
+// the last tag. every name is NUL-terminated
+static char *find_fields(char *fields, char *tag) {
+  while(*fields) {
+    int found = strcmp(fields, tag) == 0;
+    fields += strlen(fields) + 1;
+    if(found) {
+      return fields;
+    }
+
+    while(*fields) {
+      fields += strlen(fields) + 1;
+    }
+
+    fields += 1;
+  }
+
+  return NULL;
+}
+
+static void marshal_box(buffer *buf, box *val, char *fields) {
+  box key;
+  box tmp;
+
+  switch(val->type) {
+    case ITYP_NULL:
+      write_type(buf, ITYP_NULL);
+      return;
+
+    case ITYP_INT:
+      write_type(buf, ITYP_INT);
+      write_raw(buf, &val->data.si, sizeof(int64_t));
+      return;
+
+    case ITYP_FLOAT:
+      write_type(buf, ITYP_FLOAT);
+      write_raw(buf, &val->data.f, sizeof(double));
+      return;
+
+    case ITYP_BOOL: {
+      unsigned char b = val->data.ui != 0;
+      write_type(buf, ITYP_BOOL);
+      write_raw(buf, &b, 1);
+      return;
+    }
+
+    case ITYP_STR:
+      write_type(buf, ITYP_STR);
+      write_str(buf, val->data.s);
+      return;
+
+    case ITYP_TABLE:
+      break;
+
+    default:
+      // functions and cdata can't be represented in Python
+      write_type(buf, val->type);
+      return;
+  }
+
+  box tag;
+  rain_set_str(&key, "tag");
+  rain_set_null(&tag);
+  rain_get(&tag, val, &key);
+
+  if(BOX_IS(&tag, STR)) {
+    write_type(buf, MARSHAL_NODE);
+    write_str(buf, tag.data.s);
+
+    // fields may be inherited through the metatable, so each one is looked up
+    // with rain_get. null fields are left out, so the count is filled in after
+    size_t count_at = buf->len;
+    uint32_t count = 0;
+    write_raw(buf, &count, sizeof(count));
+
+    char *field = find_fields(fields, tag.data.s);
+    for(; field != NULL && *field; field += strlen(field) + 1) {
+      rain_set_str(&key, field);
+      rain_set_null(&tmp);
+      rain_get(&tmp, val, &key);
+      if(BOX_IS(&tmp, NULL)) {
+        continue;
+      }
+
+      write_str(buf, field);
+      marshal_box(buf, &tmp, fields);
+      count += 1;
+    }
+
+    write_at(buf, count_at, &count, sizeof(count));
+    return;
+  }
+
+  // arrays end at the first null, and the count is filled in afterward
+  write_type(buf, MARSHAL_ARRAY);
+  size_t count_at = buf->len;
+  uint32_t count = 0;
+  write_raw(buf, &count, sizeof(count));
+
+  while(1) {
+    rain_set_int(&key, count);
+    rain_set_null(&tmp);
+    rain_get(&tmp, val, &key);
+    if(BOX_IS(&tmp, NULL)) {
+      break;
+    }
+
+    marshal_box(buf, &tmp, fields);
+    count += 1;
+  }
+
+  write_at(buf, count_at, &count, sizeof(count));
+}
+
+// returns NULL if the buffer couldn't be allocated
+char *rain_marshal(box *val, int *len, char *fields) {
+  buffer buf;
+  buf.cap = 256;
+  buf.len = 0;
+  buf.data = malloc(buf.cap);
+
+  marshal_box(&buf, val, fields);
+
+  *len = buf.data ? buf.len : 0;
+  return buf.data;
+}
+
+void rain_marshal_free(char *data) {
+  free(data);
+}
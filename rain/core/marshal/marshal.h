@@ -0,0 +1,14 @@
+#ifndef MARSHAL_H
+#define MARSHAL_H
+
+#include "../core.h"
+
+// record markers used in marshalled buffers, in addition to ITYP_*
+#define MARSHAL_ARRAY 0x80
+#define MARSHAL_NODE 0x81
+
+int rain_unmarshal(box *, char *, box *, box *);
+char *rain_marshal(box *, int *, char *);
+void rain_marshal_free(char *);
+
+#endif
@@ -3,6 +3,7 @@
 
 #include "env/env.h"
 #include "except/except.h"
+#include "marshal/marshal.h"
 #include "ops/ops.h"
 #include "set/set.h"
 #include "table/table.h"
@@ -11,6 +11,7 @@ void rain_set_box(box *ret, box *from) {
   ret->data.ui = from->data.ui;
   ret->size = from->size;
   ret->env = from->env;
+  ret->hash = from->hash;
 }
 
 void rain_set_null(box *ret) {
@@ -18,6 +19,7 @@ void rain_set_null(box *ret) {
   ret->data.ui = 0;
   ret->size = 0;
   ret->env = NULL;
+  ret->hash = 0;
 }
 
 void rain_set_int(box *ret, signed long si) {
@@ -25,6 +27,7 @@ void rain_set_int(box *ret, signed long si) {
   ret->data.si = si;
   ret->size = 0;
   ret->env = rain_vt_int;
+  ret->hash = 0;
 }
 
 void rain_set_float(box *ret, double f) {
@@ -32,6 +35,7 @@ void rain_set_float(box *ret, double f) {
   ret->data.f = f;
   ret->size = 0;
   ret->env = rain_vt_float;
+  ret->hash = 0;
 }
 
 void rain_set_bool(box *ret, unsigned char v) {
@@ -39,6 +43,7 @@ void rain_set_bool(box *ret, unsigned char v) {
   ret->data.ui = !!v;
   ret->size = 0;
   ret->env = rain_vt_bool;
+  ret->hash = 0;
 }
 
 void rain_set_str(box *ret, char* s) {
@@ -46,6 +51,7 @@ void rain_set_str(box *ret, char* s) {
   ret->data.s = s;
   ret->size = strlen(s);
   ret->env = rain_vt_str;
+  ret->hash = rain_hash_str(s, ret->size);
 }
 
 void rain_set_strcpy(box *ret, const char *s, int size) {
@@ -55,6 +61,7 @@ void rain_set_strcpy(box *ret, const char *s, int size) {
   memcpy(ret->data.s, s, size);
   ret->data.s[size] = 0;
   ret->env = rain_vt_str;
+  ret->hash = rain_hash_str(ret->data.s, size);
 }
 
 void rain_set_table(box *ret) {
@@ -62,11 +69,13 @@ void rain_set_table(box *ret) {
   arr->cur = 0;
   arr->max = HASH_SIZE;
   arr->items = (item **)GC_malloc(sizeof(item *) * HASH_SIZE);
+  arr->version = 0;
 
   ret->type = ITYP_TABLE;
   ret->data.lpt = arr;
   ret->size = 0;
   ret->env = NULL;
+  ret->hash = 0;
 }
 
 void rain_set_func(box *ret, void *vp, int num_args) {
@@ -74,6 +83,7 @@ void rain_set_func(box *ret, void *vp, int num_args) {
   ret->data.vp = vp;
   ret->size = num_args;
   ret->env = NULL;
+  ret->hash = 0;
 }
 
 void rain_set_cdata(box *ret, void *vp) {
@@ -81,6 +91,7 @@ void rain_set_cdata(box *ret, void *vp) {
   ret->data.vp = vp;
   ret->size = 0;
   ret->env = NULL;
+  ret->hash = 0;
 }
 
 void rain_set_env(box *val, box *env) {
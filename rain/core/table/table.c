@@ -12,17 +12,27 @@ box* rain_new_table() {
   return val;
 }
 
-unsigned long rain_hash(box *val) {
-  unsigned int hash = 5381;
+// djb2 over the bytes of a string. this must match str_node.hash in ast.py,
+// which hashes string literals at compile time
+unsigned long rain_hash_str(const char *s, int size) {
+  unsigned long hash = 5381;
+
+  for(int i=0; i<size; i++) {
+    hash += (hash << 5) + (unsigned char)s[i];
+  }
+
+  return hash;
+}
 
+unsigned long rain_hash(box *val) {
   switch(val->type) {
     case ITYP_BOOL:
       return !!val->data.ui;
     case ITYP_STR:
-      for(int i=0; i<val->size; i++) {
-        hash += (hash << 5) + val->data.s[i];
+      if(val->hash == 0) {
+        val->hash = rain_hash_str(val->data.s, val->size);
       }
-      return hash;
+      return val->hash;
   }
 
   return val->data.ui;
@@ -34,17 +44,32 @@ unsigned char rain_hash_eq(box *one, box *two) {
   }
 
   if(BOX_IS(one, STR)) {
-    return strcmp(one->data.s, two->data.s) == 0;
+    if(one->data.s == two->data.s) {
+      return 1;
+    }
+
+    if(one->size != two->size) {
+      return 0;
+    }
+
+    if(one->hash != 0 && two->hash != 0 && one->hash != two->hash) {
+      return 0;
+    }
+
+    return memcmp(one->data.s, two->data.s, one->size) == 0;
   }
 
   return one->data.ui == two->data.ui;
 }
 
 item *rain_has(box *tab, box *key) {
+  return rain_has_hashed(tab, key, rain_hash(key));
+}
+
+item *rain_has_hashed(box *tab, box *key, unsigned long key_hash) {
   int cur = tab->data.lpt->cur;
   int max = tab->data.lpt->max;
   item **items = tab->data.lpt->items;
-  unsigned long key_hash = rain_hash(key);
 
   while(1) {
     if(items[key_hash % max] == NULL) {
@@ -70,6 +95,12 @@ box *rain_get_ptr(box *tab, box *key) {
 }
 
 void rain_get(box *ret, box *tab, box *key) {
+  rain_get_hashed(ret, tab, key, rain_hash(key));
+}
+
+// the hashed versions of get and put take the hash of the key, which the
+// compiler knows ahead of time for constant keys
+void rain_get_hashed(box *ret, box *tab, box *key, unsigned long key_hash) {
   box index_key;
   box index_func;
 
@@ -90,7 +121,7 @@ void rain_get(box *ret, box *tab, box *key) {
   }
 
   if(BOX_IS(tab, TABLE)) {
-    item *row = rain_has(tab, key);
+    item *row = rain_has_hashed(tab, key, key_hash);
     if(row != NULL) {
       rain_set_box(ret, &row->val);
       return;
@@ -98,12 +129,16 @@ void rain_get(box *ret, box *tab, box *key) {
   }
 
   if(rain_has_meta(tab)) {
-    rain_get(ret, tab->env, key);
+    rain_get_hashed(ret, tab->env, key, key_hash);
     return;
   }
 }
 
 void rain_put(box *tab, box *key, box *val) {
+  rain_put_hashed(tab, key, val, rain_hash(key));
+}
+
+void rain_put_hashed(box *tab, box *key, box *val, unsigned long key_hash) {
   box index_ret;
   box index_key;
   box index_func;
@@ -126,7 +161,7 @@ void rain_put(box *tab, box *key, box *val) {
   }
 
   if(BOX_IS(tab, FUNC) && rain_has_meta(tab)) {
-    rain_put(tab->env, key, val);
+    rain_put_hashed(tab->env, key, val, key_hash);
     return;
   }
 
@@ -134,14 +169,19 @@ void rain_put(box *tab, box *key, box *val) {
     rain_panic(rain_exc_arg_mismatch);
   }
 
-  rain_put_aux(tab, key, val, NULL);
+  rain_put_aux_hashed(tab, key, val, NULL, key_hash);
 }
 
 void rain_put_aux(box *tab, box *key, box *val, item *pair) {
+  rain_put_aux_hashed(tab, key, val, pair, rain_hash(key));
+}
+
+void rain_put_aux_hashed(box *tab, box *key, box *val, item *pair, unsigned long key_hash) {
   int cur = tab->data.lpt->cur;
   int max = tab->data.lpt->max;
   item **items = tab->data.lpt->items;
-  unsigned long key_hash = rain_hash(key);
+
+  tab->data.lpt->version += 1;
 
   while(1) {
     if(items[key_hash % max] == NULL) {
@@ -180,6 +220,107 @@ void rain_put_aux(box *tab, box *key, box *val, item *pair) {
   }
 }
 
+
+// inline caches
+
+// Fill a cache with the result of looking up a key above tab in its
+// metatables. Returns 0 if the lookup can't be cached: it could call a custom
+// getter, or it goes through more metatables than a cache can hold.
+static int rain_ic_fill(ic *cache, box *tab, box *key) {
+  box index_key;
+  box *found = NULL;
+  box *cur = tab;
+  int depth = 0;
+
+  rain_set_str(&index_key, "get");
+
+  while(rain_has_meta(cur)) {
+    // closures write to their environments without a put, so their versions
+    // can't be trusted
+    if(BOX_IS(cur, FUNC)) {
+      return 0;
+    }
+
+    cur = cur->env;
+
+    if(BOX_ISNT(cur, TABLE) || depth == IC_DEPTH) {
+      return 0;
+    }
+
+    item *index_row = rain_has(cur, &index_key);
+    if(index_row != NULL && BOX_IS(&index_row->val, FUNC) && index_row->val.size == 2) {
+      return 0;
+    }
+
+    if(found == NULL) {
+      item *row = rain_has(cur, key);
+      if(row != NULL) {
+        found = &row->val;
+      }
+    }
+
+    // changing any of these tables could change the result
+    cache->metas[depth] = cur->data.lpt;
+    cache->versions[depth] = cur->data.lpt->version;
+    depth += 1;
+  }
+
+  cache->depth = depth;
+
+  if(found != NULL) {
+    rain_set_box(&cache->val, found);
+  }
+  else {
+    rain_set_null(&cache->val);
+  }
+
+  return 1;
+}
+
+// Check that tab goes through the same metatables as when the cache was
+// filled, and that none of them have changed since. The metatables are
+// compared by their storage rather than their boxes, since every :: makes a
+// new box for its metatable.
+static int rain_ic_valid(ic *cache, box *tab) {
+  box *cur = tab;
+
+  for(int i=0; i<cache->depth; i++) {
+    if(!rain_has_meta(cur)) {
+      return 0;
+    }
+
+    cur = cur->env;
+    if(BOX_ISNT(cur, TABLE) || cur->data.lpt != cache->metas[i] ||
+       cur->data.lpt->version != cache->versions[i]) {
+      return 0;
+    }
+  }
+
+  return cache->depth > 0 && !rain_has_meta(cur);
+}
+
+// Look up a key like rain_get, using a call site's cache for anything that
+// isn't in the table itself.
+void rain_get_ic(box *ret, box *tab, box *key, ic *cache) {
+  if(!rain_ic_valid(cache, tab)) {
+    if(!rain_has_meta(tab) || !rain_ic_fill(cache, tab, key)) {
+      cache->depth = 0;
+      rain_get(ret, tab, key);
+      return;
+    }
+  }
+
+  if(BOX_IS(tab, TABLE)) {
+    item *row = rain_has(tab, key);
+    if(row != NULL) {
+      rain_set_box(ret, &row->val);
+      return;
+    }
+  }
+
+  rain_set_box(ret, &cache->val);
+}
+
 void rain_ext_get(box *ret, box *tab, box *key) {
   box clone;
   rain_set_box(&clone, tab);
@@ -5,12 +5,19 @@
 
 box* rain_new_table();
 unsigned char rain_hash_eq(box *, box *);
+unsigned long rain_hash_str(const char *, int);
 unsigned long rain_hash(box *);
 item *rain_has(box *, box *);
+item *rain_has_hashed(box *, box *, unsigned long);
 box *rain_get_ptr(box *, box *);
 void rain_get(box *, box *, box *);
+void rain_get_hashed(box *, box *, box *, unsigned long);
 void rain_put(box *, box *, box *);
+void rain_put_hashed(box *, box *, box *, unsigned long);
 void rain_put_aux(box *, box *, box *, item *);
+void rain_put_aux_hashed(box *, box *, box *, item *, unsigned long);
+
+void rain_get_ic(box *, box *, box *, ic *);
 
 void rain_ext_get(box *, box *, box *);
 void rain_ext_set(box *, box *, box *, box *);
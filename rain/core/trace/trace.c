@@ -1,13 +1,24 @@
+#define _GNU_SOURCE  // for dladdr
 #include "rain.h"
+#include <dlfcn.h>
+#include <stdint.h>
 #include <stdio.h>
+#include <string.h>
+#include <unwind.h>
 
 int rain_trace_i = 0;
 int rain_trace_depth = 0;
 
+// return addresses saved by rain_save_native_trace, innermost first
+static void *native_trace[TRACE_SIZE];
+static int native_depth = 0;
+
 int rain_push(char *module, int line, int column) {
-  rain_traces[rain_trace_depth].module = module;
-  rain_traces[rain_trace_depth].line = line;
-  rain_traces[rain_trace_depth].column = column;
+  // past TRACE_SIZE, the oldest records are overwritten
+  trace_record *record = rain_traces + (rain_trace_depth & TRACE_MASK);
+  record->module = module;
+  record->line = line;
+  record->column = column;
   rain_trace_depth += 1;
   return rain_trace_depth - 1;
 }
@@ -32,8 +43,55 @@ void rain_print_trace(trace_record *trace) {
   }
 }
 
+static _Unwind_Reason_Code save_frame(struct _Unwind_Context *context, void *arg) {
+  (void)arg;
+
+  if(native_depth >= TRACE_SIZE) {
+    return _URC_END_OF_STACK;
+  }
+
+  native_trace[native_depth++] = (void *)_Unwind_GetIP(context);
+  return _URC_NO_REASON;
+}
+
+// Save the native call stack, for programs compiled without tracing.
+void rain_save_native_trace() {
+  native_depth = 0;
+  _Unwind_Backtrace(save_frame, NULL);
+}
+
+static void dump_native() {
+  Dl_info info;
+
+  for(int i = native_depth - 1; i >= 0; i--) {
+    if(!dladdr(native_trace[i], &info) || info.dli_sname == NULL) {
+      continue;
+    }
+
+    // skip the runtime and anything from the C library
+    if(strncmp(info.dli_sname, "rain_", 5) == 0 || info.dli_sname[0] == '_') {
+      continue;
+    }
+
+    printf("%s: +%#lx\n", info.dli_sname,
+        (unsigned long)((uintptr_t)native_trace[i] - (uintptr_t)info.dli_saddr));
+  }
+}
+
 void rain_dump() {
-  for(rain_trace_i = 0; rain_trace_i < rain_trace_depth; rain_trace_i++) {
-    rain_print_trace(rain_traces + rain_trace_i);
+  // nothing is recorded with tracing off, so fall back to the native stack
+  if(rain_trace_depth == 0) {
+    dump_native();
+    return;
+  }
+
+  rain_trace_i = 0;
+  if(rain_trace_depth > TRACE_SIZE) {
+    rain_trace_i = rain_trace_depth - TRACE_SIZE;
+    printf("... %d more\n", rain_trace_i);
+  }
+
+  for(; rain_trace_i < rain_trace_depth; rain_trace_i++) {
+    rain_print_trace(rain_traces + (rain_trace_i & TRACE_MASK));
   }
 }
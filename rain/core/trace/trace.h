@@ -5,6 +5,10 @@
 #define LINE_INIT -2
 #define LINE_UNKNOWN -3
 
+// the trace stack is a ring, so this must be a power of two
+#define TRACE_SIZE 1024
+#define TRACE_MASK (TRACE_SIZE - 1)
+
 typedef struct trace_record {
   char *module;
   int line;
@@ -14,11 +18,12 @@ typedef struct trace_record {
 int rain_push(char *, int, int);
 int rain_pop();
 void rain_print_trace(trace_record *);
+void rain_save_native_trace();
 void rain_dump();
 
 int rain_trace_i;
 int rain_trace_depth;
 
-trace_record rain_traces[1000];
+trace_record rain_traces[TRACE_SIZE];
 
 #endif
@@ -38,10 +38,10 @@ def emit_main(self, module, mods=[]):
 
       for tmp in mods:
         if 'init' in tmp:
-          with module.trace(K.coord(M.TRACE_INIT), mod=tmp.name_ptr):
+          with module.trace(K.coord(M.TRACE_INIT), mod=tmp.name_ptr, call=True):
             module.box_call(module.load(tmp['init']))
 
-      with module.trace(K.coord(M.TRACE_MAIN)):
+      with module.trace(K.coord(M.TRACE_MAIN), call=True):
         module.box_call(module.load(module['main']))
 
       module.catch(module.builder.block)
@@ -53,6 +53,11 @@ def emit_main(self, module, mods=[]):
 @A.block_node.method
 def emit(self, module):
   for stmt in self.stmts:
+    # a folded branch can return or break in the middle of a block, and
+    # anything after that needs a block of its own, even if it's unreachable
+    if module.is_local and module.builder.block.is_terminated:
+      module.builder.position_at_end(module.builder.append_basic_block('dead'))
+
     module.emit(stmt)
 
   if self.expr:
@@ -120,7 +125,7 @@ def emit_local(self, module):
         table = module.emit(lhs.lhs)
         key = module.emit(lhs.rhs)
         args = module.fnalloc(table, key, rhs)
-        module.runtime.put(*args)
+        module.table_put(lhs.rhs, *args)
 
   elif isinstance(self.lhs, A.name_node):
     if self.var:
@@ -145,7 +150,7 @@ def emit_local(self, module):
     val = module.emit(self.rhs)
 
     args = module.fnalloc(table, key, val)
-    module.runtime.put(*args)
+    module.table_put(self.lhs.rhs, *args)
 
 
 @A.bind_node.method
@@ -219,7 +224,7 @@ def emit(self, module):
     Q.abort("Can't find module {!r}", self.name, pos=self.coords)
 
   comp = C.get_compiler(file)
-  comp.build()
+  comp.exports()
 
   module.import_llvm(comp.mod)
 
@@ -484,12 +489,8 @@ def emit(self, module):
 
 @A.str_node.method
 def emit(self, module):
-  typ = T.arr(T.i8, len(self.value) + 1)
-  ptr = module.add_global(typ, name=module.uniq('string'))
-  ptr.initializer = typ(bytearray(self.value + '\0', 'utf-8'))
-  gep = ptr.gep([T.i32(0), T.i32(0)])
-
-  return T._str(gep, len(self.value), module.get_vt('str'))
+  ptr, size = module.add_string(self.value)
+  return T._str(ptr, size, module.get_vt('str'), module.string_hash(self.value))
 
 
 @A.table_node.method
@@ -524,8 +525,9 @@ def emit_global(self, module):
 def emit_local(self, module):
   ptr = module.runtime.new_table()
   for i, item in enumerate(self.items):
-    args = module.fnalloc(A.int_node(i).emit(module), module.emit(item))
-    module.runtime.put(ptr, *args)
+    key_node = A.int_node(i)
+    args = module.fnalloc(key_node.emit(module), module.emit(item))
+    module.table_put(key_node, ptr, *args)
 
   ret = module.load(ptr)
   ret = module.insert(ret, module.get_vt('array'), T.ENV)
@@ -557,7 +559,7 @@ def emit_local(self, module):
 
   for key, item in self.items:
     args = module.fnalloc(module.emit(key), module.emit(item))
-    module.runtime.put(ptr, *args)
+    module.table_put(key, ptr, *args)
 
   ret = module.load(ptr)
 
@@ -603,15 +605,16 @@ def emit(self, module):
     module.store(func_box, self_ptr)
 
     for i, name in enumerate(bindings):
-      module.store(A.str_node(name).emit(module), key_ptr)
+      key_node = A.str_node(name)
+      module.store(key_node.emit(module), key_ptr)
 
       # cheesy hack - the only time any of these values will ever
       # have a bound value of False will be when it's the item
       # currently being bound, ie, it's this function
       if getattr(module[name], 'bound', None) is False:
-        module.runtime.put(env_ptr, key_ptr, self_ptr)
+        module.table_put(key_node, env_ptr, key_ptr, self_ptr)
       else:
-        module.runtime.put(env_ptr, key_ptr, module[name])
+        module.table_put(key_node, env_ptr, key_ptr, module[name])
 
   return func_box
 
@@ -635,7 +638,7 @@ def emit_local(self, module):
   func_box = module.emit(self.func)
   arg_boxes = [module.emit(arg) for arg in self.args]
 
-  with module.trace(self.coords):
+  with module.trace(self.coords, call=True):
     return module.box_call(func_box, arg_boxes, catch=self.catch)
 
 
@@ -644,18 +647,37 @@ def emit_global(self, module):
   Q.abort("Can't call methods at global scope", pos=self.coords)
 
 
+def emit_cached_get(module, table, key):
+  '''Look up a method through an inline cache for this call site.
+
+  The cache remembers the metatables of the last receiver, their versions,
+  and what the method resolved to there. Receivers that share those
+  metatables skip the lookup as long as none of them have changed.'''
+  cache = module.add_global(T.ic, name=module.uniq('ic'))
+  cache.initializer = T.ic(None)
+
+  ret_ptr, *args = module.fnalloc(T.null, table, key)
+  module.runtime.get_ic(ret_ptr, *args, cache)
+  return module.load(ret_ptr)
+
+
 @A.meth_node.method
 def emit_local(self, module):
   table = module.emit(self.lhs)
   key = module.emit(self.rhs)
 
-  ret_ptr, *args = module.fnalloc(T.null, table, key)
-  module.runtime.get(ret_ptr, *args)
+  # method names are constant, so the lookup can be cached
+  if C.Compiler.inline_caches and isinstance(self.rhs, A.str_node):
+    func_box = emit_cached_get(module, table, key)
+
+  else:
+    ret_ptr, *args = module.fnalloc(T.null, table, key)
+    module.table_get(self.rhs, ret_ptr, *args)
+    func_box = module.load(ret_ptr)
 
-  func_box = module.load(ret_ptr)
   arg_boxes = [table] + [module.emit(arg) for arg in self.args]
 
-  with module.trace(self.coords):
+  with module.trace(self.coords, call=True):
     return module.box_call(func_box, arg_boxes, catch=self.catch)
 
 
@@ -679,7 +701,7 @@ def emit_local(self, module):
   key = module.emit(self.rhs)
 
   ret_ptr, *args = module.fnalloc(T.null, table, key)
-  module.runtime.get(ret_ptr, *args)
+  module.table_get(self.rhs, ret_ptr, *args)
   return module.load(ret_ptr)
 
 
@@ -725,6 +747,100 @@ def emit_global(self, module):
     Q.abort("Can't use binary operators at global scope", pos=self.coords)
 
 
+# ops that are emitted inline when both operands are ints or both are floats.
+# the runtime is only called for anything else (like tables with magic methods)
+int_arith = {'+': 'add', '-': 'sub', '*': 'mul'}
+float_arith = {'+': 'fadd', '-': 'fsub', '*': 'fmul', '/': 'fdiv'}
+compares = ('<', '<=', '>', '>=')
+
+
+def fast_cases(module, op, lhs, rhs):
+  '''Return (condition, emitter) pairs for the inline cases of an operator.'''
+  builder = module.builder
+  lhs_typ, rhs_typ = module.get_type(lhs), module.get_type(rhs)
+  lhs_val, rhs_val = module.get_value(lhs), module.get_value(rhs)
+
+  def both(ityp):
+    lhs_is = builder.icmp_unsigned('==', lhs_typ, ityp)
+    rhs_is = builder.icmp_unsigned('==', rhs_typ, ityp)
+    return builder.and_(lhs_is, rhs_is)
+
+  def make_bool(flag):
+    return module.insert(T._bool(0, module.get_vt('bool')), builder.zext(flag, T.cast.bool), T.DATA)
+
+  def make_float(val):
+    return module.insert(T._float(0, module.get_vt('float')),
+                         builder.bitcast(val, T.cast.int), T.DATA)
+
+  def floats():
+    return builder.bitcast(lhs_val, T.cast.float), builder.bitcast(rhs_val, T.cast.float)
+
+  cases = []
+  if op in int_arith:
+    def emit_int():
+      val = getattr(builder, int_arith[op])(lhs_val, rhs_val)
+      return module.insert(T._int(0, module.get_vt('int')), val, T.DATA)
+
+    cases.append((lambda: both(T.ityp.int), emit_int))
+
+  if op in float_arith:
+    cases.append((lambda: both(T.ityp.float),
+                  lambda: make_float(getattr(builder, float_arith[op])(*floats()))))
+
+  if op in compares:
+    cases.append((lambda: both(T.ityp.int),
+                  lambda: make_bool(builder.icmp_signed(op, lhs_val, rhs_val))))
+    cases.append((lambda: both(T.ityp.float),
+                  lambda: make_bool(builder.fcmp_ordered(op, *floats()))))
+
+  if op in ('==', '!='):
+    # like rain_hash_eq, boxes are equal if their types and raw data are,
+    # except for strings, which are compared by the runtime
+    def emit_eq():
+      same_typ = builder.icmp_unsigned('==', lhs_typ, rhs_typ)
+      same_val = builder.icmp_unsigned('==', lhs_val, rhs_val)
+      flag = builder.and_(same_typ, same_val)
+      if op == '!=':
+        flag = builder.not_(flag)
+      return make_bool(flag)
+
+    cases.append((lambda: builder.not_(both(T.ityp.str)), emit_eq))
+
+  return cases
+
+
+def emit_fast_binary(module, op, lhs, rhs, slow):
+  '''Emit the inline cases of an operator, then a call to slow for the rest.'''
+  builder = module.builder
+  results = []
+
+  for cond, emit_case in fast_cases(module, op, lhs, rhs):
+    fast = builder.append_basic_block('fast')
+    rest = builder.append_basic_block('slow')
+    builder.cbranch(cond(), fast, rest)
+
+    builder.position_at_end(fast)
+    results.append((emit_case(), builder.block))
+    builder.position_at_end(rest)
+
+  results.append((slow(), builder.block))
+
+  if len(results) == 1:
+    return results[0][0]
+
+  done = builder.append_basic_block('done')
+  for val, block in results:
+    builder.position_at_end(block)
+    builder.branch(done)
+
+  builder.position_at_end(done)
+  res = builder.phi(T.box)
+  for val, block in results:
+    res.add_incoming(val, block)
+
+  return res
+
+
 @A.binary_node.method
 def emit_local(self, module):
   arith = {
@@ -770,12 +886,18 @@ def emit_local(self, module):
     lhs = module.emit(self.lhs)
     rhs = module.emit(self.rhs)
 
-    ret_ptr, *args = module.fnalloc(T.null, lhs, rhs)
+    def slow():
+      ret_ptr, *args = module.fnalloc(T.null, lhs, rhs)
+
+      with module.trace(self.coords):
+        arith[self.op](ret_ptr, *args)
+
+      return module.load(ret_ptr)
 
-    with module.trace(self.coords):
-      arith[self.op](ret_ptr, *args)
+    if not C.Compiler.fast_ops:
+      return slow()
 
-    return module.load(ret_ptr)
+    return emit_fast_binary(module, self.op, lhs, rhs, slow)
 
   else:
     Q.abort("Invalid binary operator {!r}", self.op, pos=self.coords)
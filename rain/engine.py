@@ -2,12 +2,25 @@ from . import ast as A
 from . import error as Q
 from . import token as K
 from . import types as T
+from contextlib import contextmanager
 import ctypes as ct
 import llvmlite.binding as llvm
+import struct
+
+# globals closer together than this are registered as a single GC root
+ROOT_GAP = 4096
+
+# record markers used by rain_marshal / rain_unmarshal, in addition to typi
+MARSHAL_ARRAY = 0x80
+MARSHAL_NODE = 0x81
+
+
+class MarshalError(Exception):
+  '''Raised for a value that can't be converted between Python and Rain.'''
 
 
 class Engine:
-  def __init__(self):
+  def __init__(self, cache=None):
     llvm.initialize()
     llvm.initialize_native_target()
     llvm.initialize_native_asmprinter()  # yes, even this one
@@ -16,11 +29,24 @@ class Engine:
     target = llvm.Target.from_default_triple()
     target_machine = target.create_target_machine()
 
+    # Modules are named after a hash of their IR so that their machine code
+    # can be saved in (and loaded from) the build cache
+    self.cache = cache
+    self.objects = set()  # names of the modules that can be cached
+    self.triple = target_machine.triple
+
     # And an execution engine with a backing module
     self.main_mod = self.compile_ir('')
 
     self.engine = llvm.create_mcjit_compiler(self.main_mod, target_machine)
     self.files = set()
+    self.funcs = {}
+    self.unrooted = []  # modules whose globals haven't been given to the GC
+    self.ast_tags = set()  # AST tags that are known to exist in core.ast
+    self.ast_fields = None  # the slots of every AST node, for rain_marshal
+
+    if self.cache:
+      self.engine.set_object_cache(self.save_object, self.load_object)
 
   # Compilation ###############################################################
 
@@ -28,8 +54,32 @@ class Engine:
     '''Create an LLVM module from IR'''
     mod = llvm.parse_assembly(llvm_ir)
     mod.verify()
+
+    if self.cache:
+      version = '.'.join(str(x) for x in llvm.llvm_version_info)
+      key = self.cache.digest('object', version, self.triple, llvm_ir)
+      mod.name = key
+      self.objects.add(key)
+
     return mod
 
+  # Object cache ##############################################################
+
+  def save_object(self, mod, data):
+    '''Save the machine code of a freshly compiled module'''
+    if mod.name in self.objects:
+      self.cache.put_data(mod.name, 'module.o', data)
+
+  def load_object(self, mod):
+    '''Return the cached machine code of a module, if there is any'''
+    if mod.name not in self.objects:
+      return None
+
+    path = self.cache.get(mod.name, 'module.o')
+    if path:
+      with open(path, 'rb') as tmp:
+        return tmp.read()
+
   def compile_file(self, ll_file):
     '''Create an LLVM module from a file'''
     with open(ll_file) as tmp:
@@ -42,24 +92,92 @@ class Engine:
     for lib in libs:
       llvm.load_library_permanently(lib)
 
+  def add_module(self, mod):
+    self.engine.add_module(mod)
+    self.unrooted.append(mod)
+
   def add_ir(self, llvm_ir):
     '''Add an LLVM module to the engine from IR'''
-    self.engine.add_module(self.compile_ir(llvm_ir))
+    self.add_module(self.compile_ir(llvm_ir))
 
   def add_file(self, *files):
     '''Add an LLVM module to the engine from a file'''
     for file in set(files) - self.files:
-      self.engine.add_module(self.compile_file(file))
+      self.add_module(self.compile_file(file))
       self.files.add(file)
 
   def finalize(self):
     '''Ensure that modules are ready for execution'''
     self.engine.finalize_object()
+    self.add_roots()
+
+  # Garbage collection ########################################################
+
+  def root_ranges(self, mods):
+    '''Return the merged address ranges of the globals defined by modules'''
+    ranges = []
+
+    for mod in mods:
+      for val in mod.global_variables:
+        if val.is_declaration or val.linkage == llvm.Linkage.available_externally:
+          continue
+
+        start = self.engine.get_global_value_address(val.name)
+        if start:
+          ranges.append((start, start + self.global_size(val)))
+
+    # merging nearby globals keeps the number of roots down. the gap is smaller
+    # than a page, so everything in a merged range is mapped memory
+    merged = []
+    for start, end in sorted(ranges):
+      if merged and start - merged[-1][1] < ROOT_GAP:
+        merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+      else:
+        merged.append((start, end))
+
+    return merged
+
+  def global_size(self, val):
+    '''Return the size in bytes of a global variable'''
+    target_data = self.engine.target_data
+    if hasattr(val, 'global_value_type'):  # opaque pointers in newer LLVMs
+      return target_data.get_abi_size(val.global_value_type)
+    return target_data.get_pointee_abi_size(val.type)
+
+  def add_roots(self):
+    '''Register the globals of new modules with the GC
+
+    Boehm only scans the data sections of the executable and of shared
+    libraries, not the memory that MCJIT puts module globals in.'''
+    if not self.unrooted:
+      return
+
+    add_roots = self.get_func('GC_add_roots', None, ct.c_void_p, ct.c_void_p)
+    for start, end in self.root_ranges(self.unrooted):
+      add_roots(start, end)
+
+    self.unrooted = []
+
+  @contextmanager
+  def rooted(self, obj):
+    '''Register a ctypes object as a GC root while it's in use'''
+    start = ct.addressof(obj)
+    end = start + ct.sizeof(obj)
+
+    self.get_func('GC_add_roots', None, ct.c_void_p, ct.c_void_p)(start, end)
+    try:
+      yield obj
+    finally:
+      self.get_func('GC_remove_roots', None, ct.c_void_p, ct.c_void_p)(start, end)
 
   # Lookups ###################################################################
 
   def get_func(self, name, *types):
     '''Return a function address'''
+    key = (name,) + types
+    if key in self.funcs:
+      return self.funcs[key]
+
     func_typ = ct.CFUNCTYPE(*types)
     func_ptr = self.engine.get_function_address(name)
 
@@ -69,7 +187,8 @@ class Engine:
     if not func_ptr:
       Q.abort('Unable to find address of {}', name)
 
-    return func_typ(func_ptr)
+    self.funcs[key] = func_typ(func_ptr)
+    return self.funcs[key]
 
   def get_global(self, name, typ):
     '''Return a global address'''
@@ -79,13 +198,18 @@ class Engine:
 
   # Runtime configuration #####################################################
 
-  def main(self):
+  def main(self, argv=('test',)):
+    '''Run the main function with some command line arguments'''
     main = self.get_func('main', ct.c_int, ct.c_int, ct.POINTER(ct.c_char_p))
 
-    argc = ct.c_int(1)
-    argv_0 = ct.c_char_p("test".encode("utf-8"))
+    argc = ct.c_int(len(argv))
+    argv = (ct.c_char_p * (len(argv) + 1))(*[arg.encode('utf-8') for arg in argv], None)
 
-    return main(argc, ct.byref(argv_0))
+    ret = main(argc, argv)
+
+    # flush anything the program printed before Python prints anything else
+    ct.CDLL(None).fflush(None)
+    return ret
 
   def enable_gc(self):
     enable_gc = self.get_func('GC_enable', None)
@@ -140,64 +264,165 @@ class Engine:
 
   # Rain <-> Python conversions ###############################################
 
-  def to_rain(self, val):
-    if isinstance(val, (list, tuple)):
-      table_box = T.cbox.to_rain(None)
-      self.rain_set_table(table_box)
+  def to_rain(self, val, ret_box=None):
+    '''Convert a Python value (or an entire AST) to a Rain box'''
+    parts = []
+    self.marshal(val, parts)
+    buf = ct.create_string_buffer(b''.join(parts))
+    T.cbox.save(buf)
+
+    unmarshal = self.get_func('rain_unmarshal', ct.c_int, T.carg, ct.c_char_p, T.carg, T.carg)
+    array_ptr = self.get_global('core.types.array.module', T.carg)
+    ast_ptr = self.get_global('core.ast.module', T.carg)
+
+    if ret_box is None:
+      ret_box = T.cbox.to_rain(None)
+
+    if not unmarshal(ct.byref(ret_box), buf, array_ptr, ast_ptr):
+      Q.abort('Unable to convert {!r} to Rain', val)
+
+    return ret_box
+
+  def to_py(self, box):
+    '''Convert a Rain box (or an entire AST) to a Python value'''
+    marshal = self.get_func('rain_marshal', ct.c_void_p, T.carg, ct.POINTER(ct.c_int),
+                            ct.c_char_p)
+    free = self.get_func('rain_marshal_free', None, ct.c_void_p)
+
+    length = ct.c_int(0)
+    ptr = marshal(ct.byref(box), ct.byref(length), self.node_fields())
+    if not ptr:
+      Q.abort('Unable to convert {!s} to Python', box)
+
+    data = ct.string_at(ptr, length.value)
+    free(ptr)
+
+    val, pos = self.unmarshal(memoryview(data), 0)
+    return val
+
+  # Flat buffer format ########################################################
+
+  def marshal_str(self, val, parts):
+    data = val.encode('utf-8')
+    parts.append(struct.pack('=I', len(data)))
+    parts.append(data)
+
+  def marshal(self, val, parts):
+    '''Serialize a value into the format read by rain_unmarshal'''
+    if isinstance(val, K.value_token):
+      val = val.value
 
-      meta_ptr = self.get_global('core.types.array.module', T.carg)
-      self.rain_set_env(table_box, meta_ptr)
+    if val is None:
+      parts.append(struct.pack('=B', T.typi.null))
 
-      for i, n in enumerate(val):
-        self.rain_put_py(table_box, i, self.to_rain(n))
+    elif val is True or val is False:
+      parts.append(struct.pack('=BB', T.typi.bool, val))
 
-      return table_box
+    elif isinstance(val, int):
+      parts.append(struct.pack('=BQ', T.typi.int, val & 0xFFFFFFFFFFFFFFFF))
+
+    elif isinstance(val, float):
+      parts.append(struct.pack('=Bd', T.typi.float, val))
+
+    elif isinstance(val, str):
+      parts.append(struct.pack('=B', T.typi.str))
+      self.marshal_str(val, parts)
+
+    elif isinstance(val, (list, tuple)):
+      parts.append(struct.pack('=BI', MARSHAL_ARRAY, len(val)))
+      for item in val:
+        self.marshal(item, parts)
 
     elif isinstance(val, A.node):
-      table_box = T.cbox.to_rain(None)
-      self.rain_set_table(table_box)
+      self.check_tag(val.__tag__)
 
-      ast_ptr = self.get_global('core.ast.module', T.carg)
-      meta_ptr = self.rain_get_ptr_py(ast_ptr, val.__tag__)
-      if not ct.cast(meta_ptr, ct.c_void_p).value:
-        Q.abort('Unable to look up core.ast.{}'.format(val.__tag__))
+      slots = type(val).__slots__
+      parts.append(struct.pack('=B', MARSHAL_NODE))
+      self.marshal_str(val.__tag__, parts)
+      parts.append(struct.pack('=I', len(slots)))
+      for key in slots:
+        self.marshal_str(key, parts)
+        self.marshal(getattr(val, key, None), parts)
 
-      self.rain_set_env(table_box, meta_ptr)
+    else:
+      raise MarshalError("Can't convert value {!r} to Rain".format(val))
 
-      slots = [self.to_rain(getattr(val, key, None)) for key in val.__slots__]
+  def node_fields(self):
+    '''List the slots of every AST node, in the format read by rain_marshal
 
-      for key, box in zip(val.__slots__, slots):
-        self.rain_put_py(table_box, key, box)
+    Each tag is followed by its slot names and an empty string, and the list
+    ends with another empty string.'''
+    if self.ast_fields is None:
+      parts = []
+      for tag, node_type in sorted(A.tag_registry.items()):
+        parts.extend(name.encode('utf-8') + b'\0' for name in (tag,) + tuple(node_type.__slots__))
+        parts.append(b'\0')
 
-      return table_box
+      parts.append(b'\0')
+      self.ast_fields = ct.create_string_buffer(b''.join(parts))
 
-    elif isinstance(val, K.value_token):
-      return T.cbox.to_rain(val.value)
+    return self.ast_fields
 
-    return T.cbox.to_rain(val)
+  def check_tag(self, tag):
+    if tag in self.ast_tags:
+      return
 
-  def to_py(self, box):
-    if box.type == T.typi.table:
-      tag_box = self.rain_get_py(box, 'tag')
-      tag = self.to_py(tag_box)
+    ast_ptr = self.get_global('core.ast.module', T.carg)
+    meta_ptr = self.rain_get_ptr_py(ast_ptr, tag)
+    if not ct.cast(meta_ptr, ct.c_void_p).value:
+      Q.abort('Unable to look up core.ast.{}'.format(tag))
 
-      if tag:
-        node_type = A.tag_registry[tag]
-        slots = [self.to_py(self.rain_get_py(box, slot)) for slot in node_type.__slots__]
+    self.ast_tags.add(tag)
 
-        return node_type(*slots)
+  def unmarshal_str(self, data, pos):
+    size, = struct.unpack_from('=I', data, pos)
+    pos += 4
+    return str(data[pos:pos + size], 'utf-8'), pos + size
 
-      else:
-        res = []
-        i = 0
-        while True:
-          next = self.to_py(self.rain_get_py(box, i))
-          if next is None:
-            break
+  def unmarshal(self, data, pos):
+    '''Deserialize a value written by rain_marshal'''
+    typ = data[pos]
+    pos += 1
+
+    if typ == T.typi.null:
+      return None, pos
+
+    elif typ == T.typi.bool:
+      return bool(data[pos]), pos + 1
+
+    elif typ == T.typi.int:
+      return struct.unpack_from('=q', data, pos)[0], pos + 8
+
+    elif typ == T.typi.float:
+      return struct.unpack_from('=d', data, pos)[0], pos + 8
+
+    elif typ == T.typi.str:
+      return self.unmarshal_str(data, pos)
+
+    elif typ == MARSHAL_ARRAY:
+      count, = struct.unpack_from('=I', data, pos)
+      pos += 4
+
+      res = []
+      for i in range(count):
+        item, pos = self.unmarshal(data, pos)
+        res.append(item)
+
+      return res, pos
+
+    elif typ == MARSHAL_NODE:
+      tag, pos = self.unmarshal_str(data, pos)
+      count, = struct.unpack_from('=I', data, pos)
+      pos += 4
 
-          res.append(next)
-          i += 1
+      slots = {}
+      for i in range(count):
+        key, pos = self.unmarshal_str(data, pos)
+        slots[key], pos = self.unmarshal(data, pos)
 
-        return res
+      node_type = A.tag_registry[tag]
+      return node_type(*[slots.get(slot) for slot in node_type.__slots__]), pos
 
-    return box.to_py()
+    names = {num: name for name, num in vars(T.typi).items() if isinstance(num, int)}
+    raise MarshalError("Can't convert value of type {} (tag {}) to Python"
+                       .format(names.get(typ, 'unknown'), typ))
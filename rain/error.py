@@ -20,6 +20,7 @@ def show_line(pos, hi=lambda x: X(x, 'red', attrs=['bold'])):
 
 
 def abort(fmt, *args, pos=coord()):
+  pos = pos or coord()  # nodes may not have a position
   err = X('error', 'red')
 
   print('{}: {!s}{}'.format(err, pos, fmt.format(*args)))
@@ -28,6 +29,7 @@ def abort(fmt, *args, pos=coord()):
 
 
 def warn(fmt, *args, pos=coord()):
+  pos = pos or coord()
   err = X('warning', 'blue')
 
   print('{}: {!s}{}'.format(err, pos, fmt.format(*args)))
@@ -35,6 +37,7 @@ def warn(fmt, *args, pos=coord()):
 
 
 def hint(fmt, *args, pos=coord()):
+  pos = pos or coord()
   err = X('hint', 'green')
 
   print('{}: {!s}{}'.format(err, pos, fmt.format(*args)))
@@ -42,4 +45,5 @@ def hint(fmt, *args, pos=coord()):
 
 
 def panic(fmt, *args, pos=coord()):
+  pos = pos or coord()
   raise Exception('{!s}{}'.format(pos, fmt.format(*args)))
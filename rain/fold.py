@@ -0,0 +1,261 @@
+from . import ast as A
+import struct
+
+# Constant folding ############################################################
+#
+# This runs over the AST between parsing and emission. Operations on literals
+# are computed here instead of by the runtime, following the same rules as the
+# runtime (see core/ops/ops.c). Anything that would panic at runtime, like
+# adding a string to an int or dividing by zero, is left alone.
+
+INT_MIN = -2 ** 63
+
+
+class folding:
+  def __init__(self):
+    self.count = 0
+
+  def replace(self, old, new):
+    '''Replace a node with a folded one, keeping its position.'''
+    if getattr(new, '_coords', None) is None:
+      new.coords = getattr(old, '_coords', None)
+
+    self.count += 1
+    return new
+
+
+def fold_tree(tree):
+  '''Fold the constant expressions in a tree. Returns the new tree and the
+  number of nodes that were folded.'''
+  stats = folding()
+  tree = fold_value(tree, stats)
+  return tree, stats.count
+
+
+def fold_value(val, stats):
+  if isinstance(val, A.node):
+    return val.fold(stats)
+
+  elif isinstance(val, list):
+    return [fold_value(item, stats) for item in val]
+
+  elif isinstance(val, tuple):
+    return tuple(fold_value(item, stats) for item in val)
+
+  return val
+
+
+# Helpers #####################################################################
+
+def wrap(val):
+  '''Wrap an int like a signed 64-bit integer.'''
+  return (val - INT_MIN) % 2 ** 64 + INT_MIN
+
+
+def float_bits(val):
+  return struct.unpack('Q', struct.pack('d', val))[0]
+
+
+def is_int(node):
+  # ints that don't fit in 64 bits are left for the emitter to deal with
+  return type(node) is A.int_node and INT_MIN <= node.value < -INT_MIN
+
+
+def is_num(node):
+  return is_int(node) or type(node) is A.float_node
+
+
+def is_str(node):
+  # the runtime uses C strings, so anything with a null byte is left to it
+  return type(node) is A.str_node and '\0' not in node.value
+
+
+def truthy(node):
+  '''Return whether a literal is truthy, or None if it's not a literal.'''
+  if type(node) is A.null_node:
+    return False
+  elif is_int(node):
+    return node.value != 0
+  elif type(node) is A.float_node:
+    return float_bits(node.value) != 0
+  elif type(node) is A.bool_node:
+    return bool(node.value)
+  elif type(node) is A.str_node:
+    return True
+
+
+def equal(lhs, rhs):
+  '''Return whether two literals are equal, or None if that's unknown.'''
+  if truthy(lhs) is None or truthy(rhs) is None:
+    return None
+  elif type(lhs) is not type(rhs):
+    return False
+  elif type(lhs) is A.null_node:
+    return True
+  elif type(lhs) is A.float_node:
+    return float_bits(lhs.value) == float_bits(rhs.value)
+  elif type(lhs) is A.str_node:
+    if is_str(lhs) and is_str(rhs):
+      return lhs.value == rhs.value
+    return None
+
+  return lhs.value == rhs.value
+
+
+def declares(node):
+  '''Return whether a subtree declares any names in its function.'''
+  if isinstance(node, (A.for_node, A.with_node, A.bind_node)):
+    return True
+  elif isinstance(node, A.assn_node) and node.var:
+    return True
+
+  if isinstance(node, A.node):
+    return any(declares(getattr(node, slot)) for slot in type(node).__slots__)
+  elif isinstance(node, (list, tuple)):
+    return any(declares(item) for item in node)
+
+  return False
+
+
+def arith(op, lhs, rhs):
+  if is_int(lhs) and is_int(rhs):
+    if op == '+':
+      return A.int_node(wrap(lhs.value + rhs.value))
+    elif op == '-':
+      return A.int_node(wrap(lhs.value - rhs.value))
+    elif op == '*':
+      return A.int_node(wrap(lhs.value * rhs.value))
+    elif op == '/':
+      if rhs.value == 0 or (lhs.value == INT_MIN and rhs.value == -1):
+        return None
+
+      # C division truncates towards zero
+      quot = abs(lhs.value) // abs(rhs.value)
+      if (lhs.value < 0) != (rhs.value < 0):
+        quot = -quot
+      return A.int_node(quot)
+
+  lhs_f = float(lhs.value)
+  rhs_f = float(rhs.value)
+
+  if op == '+':
+    return A.float_node(lhs_f + rhs_f)
+  elif op == '-':
+    return A.float_node(lhs_f - rhs_f)
+  elif op == '*':
+    return A.float_node(lhs_f * rhs_f)
+  elif op == '/' and rhs_f != 0:
+    return A.float_node(lhs_f / rhs_f)
+
+
+def compare(op, lhs, rhs):
+  if is_num(lhs) and is_num(rhs):
+    if is_int(lhs) and is_int(rhs):
+      lhs, rhs = lhs.value, rhs.value
+    else:
+      lhs, rhs = float(lhs.value), float(rhs.value)
+
+  elif is_str(lhs) and is_str(rhs):
+    # UTF-8 sorts the same way as code points, so this matches strcmp
+    lhs, rhs = lhs.value, rhs.value
+
+  else:
+    return None
+
+  if op == '<':
+    return lhs < rhs
+  elif op == '<=':
+    return lhs <= rhs
+  elif op == '>':
+    return lhs > rhs
+  elif op == '>=':
+    return lhs >= rhs
+
+
+# Folding #####################################################################
+
+@A.node.method
+def fold(self, stats):
+  for slot in type(self).__slots__:
+    if slot != '_coords':
+      setattr(self, slot, fold_value(getattr(self, slot), stats))
+
+  return self
+
+
+@A.binary_node.method
+def fold(self, stats):
+  self.lhs = fold_value(self.lhs, stats)
+  self.rhs = fold_value(self.rhs, stats)
+  lhs, rhs = self.lhs, self.rhs
+
+  if self.op in ('&', '|'):
+    cond = truthy(lhs)
+    if cond is None:
+      return self
+
+    # the lhs is the result if it decides the outcome, otherwise the rhs
+    if cond == (self.op == '|'):
+      return stats.replace(self, lhs)
+    return stats.replace(self, rhs)
+
+  elif self.op in ('+', '-', '*', '/'):
+    if is_num(lhs) and is_num(rhs):
+      res = arith(self.op, lhs, rhs)
+      if res is not None:
+        return stats.replace(self, res)
+
+  elif self.op in ('<', '<=', '>', '>='):
+    res = compare(self.op, lhs, rhs)
+    if res is not None:
+      return stats.replace(self, A.bool_node(res))
+
+  elif self.op in ('==', '!='):
+    res = equal(lhs, rhs)
+    if res is not None:
+      return stats.replace(self, A.bool_node(res == (self.op == '==')))
+
+  elif self.op == '$':
+    if is_str(lhs) and is_str(rhs):
+      return stats.replace(self, A.str_node(lhs.value + rhs.value))
+
+  return self
+
+
+@A.unary_node.method
+def fold(self, stats):
+  self.val = fold_value(self.val, stats)
+
+  if self.op == '!':
+    cond = truthy(self.val)
+    if cond is not None:
+      return stats.replace(self, A.bool_node(not cond))
+
+  elif self.op == '-':
+    if is_int(self.val):
+      return stats.replace(self, A.int_node(wrap(-self.val.value)))
+    elif type(self.val) is A.float_node:
+      return stats.replace(self, A.float_node(-self.val.value))
+
+  return self
+
+
+@A.if_node.method
+def fold(self, stats):
+  self.pred = fold_value(self.pred, stats)
+  self.body = fold_value(self.body, stats)
+  self.els = fold_value(self.els, stats)
+
+  cond = truthy(self.pred)
+  if cond is None:
+    return self
+
+  # names are declared for the whole function, so a branch that declares any
+  # can't be dropped without changing what the rest of the function sees
+  if cond and not declares(self.els):
+    return stats.replace(self, self.body)
+
+  elif not cond and not declares(self.body):
+    return stats.replace(self, self.els or A.pass_node())
+
+  return self
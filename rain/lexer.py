@@ -56,47 +56,51 @@ raw[r'[a-zA-Z_][a-zA-Z0-9_]*'] = factory
 raw['|'.join(re.escape(x) for x in OPERATORS)] = operator_token
 raw[r'.'] = symbol_token
 
-rules = OrderedDict()
-for k, v in raw.items():
-  rules[re.compile(k)] = v
+# all of the rules in one regex. alternatives are tried in order, so this
+# matches the same way as trying each rule in turn
+master = re.compile('|'.join('(?P<r{}>{})'.format(i, k) for i, k in enumerate(raw)))
+kinds = {'r{}'.format(i): v for i, v in enumerate(raw.values())}
 
-indent = re.compile('^[ ]*')
+indent = re.compile('[ ]*')
 
-ignore_whitespace = []
+opening = (symbol_token('['), symbol_token('{'), symbol_token('('))
+closing = (symbol_token(']'), symbol_token('}'), symbol_token(')'))
 
 
 def stream(source):
+  '''Scan source into tokens.
+
+  The scanner keeps an index into source instead of slicing off what it has
+  consumed, so lexing a file takes time linear in its size. All of the state
+  lives in the generator, so any number of streams can be lexed at once.'''
   indents = [0]
+  brackets = 0  # whitespace is ignored inside brackets
   line = 1
   col = 1
-
-  def skip(amt):
-    nonlocal source, col
-    source = source[amt:]
-    col += amt
+  idx = 0
+  end = len(source)
 
   last = None
-  while source:
-    if source[0] == '\n':
+  while idx < end:
+    if source[idx] == '\n':
       # skip repeated newlines
-      while source and source[0] == '\n':
-        skip(1)
+      while idx < end and source[idx] == '\n':
+        idx += 1
         col = 1
         line += 1
 
       # get this line's indentation
-      depth = indent.match(source)
-      depth_amt = len(depth.group(0))
+      depth_amt = indent.match(source, idx).end() - idx
 
       # skip this line if it was just an indentation
-      if source and source[depth_amt] == '\n':
-        skip(1)
+      if idx + depth_amt < end and source[idx + depth_amt] == '\n':
+        idx += 1
         col = 1
         line += 1
         continue
 
       # handle indents
-      if not ignore_whitespace:
+      if not brackets:
         if depth_amt > indents[-1]:
           last = indent_token(pos=coord(line, col, len=depth_amt))
           yield last
@@ -115,33 +119,35 @@ def stream(source):
           yield last
           del indents[-1]
 
-      skip(depth_amt)
-      if not source:
+      idx += depth_amt
+      col += depth_amt
+      if idx >= end:
         break
 
     # skip internal whitespace
-    if source[0].isspace():
-      skip(1)
+    if source[idx].isspace():
+      idx += 1
+      col += 1
       continue
 
     # tokenize
-    for rule, kind in rules.items():
-      match = rule.match(source)
-      if match:
-        value = match.group(0)
-        if kind:
-          last = kind(value, pos=coord(line, col, len=len(value)))
-
-          if last in (symbol_token('['), symbol_token('{'), symbol_token('(')):
-            ignore_whitespace.append(True)
-          elif last in (symbol_token(']'), symbol_token('}'), symbol_token(')')):
-            if ignore_whitespace:
-              ignore_whitespace.pop()
-            else:
-              Q.abort('unmatched brace', pos=coord(line, col))
+    match = master.match(source, idx)
+    value = match.group()
+    kind = kinds[match.lastgroup]
+    if kind:
+      last = kind(value, pos=coord(line, col, len=len(value)))
+
+      if last in opening:
+        brackets += 1
+      elif last in closing:
+        if brackets:
+          brackets -= 1
+        else:
+          Q.abort('unmatched brace', pos=coord(line, col))
 
-          yield last
-        skip(len(value))
-        break
+      yield last
+
+    idx += len(value)
+    col += len(value)
 
   yield end_token(pos=coord(line, col))
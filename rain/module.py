@@ -7,9 +7,13 @@ from . import types as T
 from contextlib import contextmanager
 from llvmlite import binding
 from llvmlite import ir
+from orderedset import OrderedSet
 from os.path import isdir, isfile
 from os.path import join
+import hashlib
+import io
 import os.path
+import pickle
 import re
 
 name_chars = re.compile('[^a-z0-9]')
@@ -92,9 +96,11 @@ class Module(S.Scope):
       key = key.value
     return normalize_name(key)
 
-  def __init__(self, file=None, name=None):
+  def __init__(self, file=None, name=None, tracing='full'):
     S.Scope.__init__(self)
 
+    self.tracing = tracing  # 'full', 'lite', or 'off' - see trace()
+
     if name:
       self.qname = self.mname = name
     else:
@@ -112,13 +118,13 @@ class Module(S.Scope):
 
     self.runtime.declare()
 
-    typ = T.arr(T.i8, len(self.qname) + 1)
-    ptr = self.add_global(typ, name=self.mangle('_name'))
-    ptr.initializer = typ(bytearray(self.qname + '\0', 'utf-8'))
-    self.name_ptr = ptr.gep([T.i32(0), T.i32(0)])
+    self.strings = {}  # pooled string constants - see add_string()
+    self.hashes = {}   # hashes of string keys, computed at compile time
+    self.name_ptr, _ = self.add_string(self.qname)
 
     self.trace_depth = self.find_global(T.i32, name='rain_trace_depth')
     self.trace_depth.linkage = 'available_externally'
+    self.traces = self.find_global(T.arr(T.trace, T.TRACE_SIZE), name='rain_traces')
 
     self.builder = None
     self.arg_ptrs = None
@@ -212,6 +218,57 @@ class Module(S.Scope):
 
     return self.add_global(typ, name=name)
 
+  # get a pointer to a string constant and its size in bytes. identical strings
+  # share one global in a module, and the same name in every module, so the
+  # linker can merge them across modules too
+  def add_string(self, value):
+    if value in self.strings:
+      return self.strings[value]
+
+    data = bytearray(value + '\0', 'utf-8')
+    typ = T.arr(T.i8, len(data))
+    name = 'str:' + hashlib.sha1(data).hexdigest()[:20]
+
+    # this might have been imported from another module, but it needs to be
+    # defined here as well
+    ptr = self.find_global(typ, name)
+    ptr.initializer = typ(data)
+    ptr.global_constant = True
+    ptr.linkage = 'linkonce_odr'
+
+    self.strings[value] = ptr.gep([T.i32(0), T.i32(0)]), len(data) - 1
+    return self.strings[value]
+
+  # get the hash of a string key
+  def string_hash(self, value):
+    if value not in self.hashes:
+      self.hashes[value] = A.str_node(value).hash()
+
+    return self.hashes[value]
+
+  # get the hash of a constant key, or None if it's only known at runtime
+  def key_hash(self, key_node):
+    if isinstance(key_node, A.str_node):
+      return self.string_hash(key_node.value)
+    elif isinstance(key_node, A.literal_node):
+      return key_node.hash()
+
+  # call rain_get, or rain_get_hashed if the key is constant
+  def table_get(self, key_node, ret_ptr, table_ptr, key_ptr):
+    key_hash = self.key_hash(key_node)
+    if key_hash is None:
+      self.runtime.get(ret_ptr, table_ptr, key_ptr)
+    else:
+      self.runtime.get_hashed(ret_ptr, table_ptr, key_ptr, T.i64(key_hash))
+
+  # call rain_put, or rain_put_hashed if the key is constant
+  def table_put(self, key_node, table_ptr, key_ptr, val_ptr):
+    key_hash = self.key_hash(key_node)
+    if key_hash is None:
+      self.runtime.put(table_ptr, key_ptr, val_ptr)
+    else:
+      self.runtime.put_hashed(table_ptr, key_ptr, val_ptr, T.i64(key_hash))
+
   # import globals from another module
   def import_llvm(self, other):
     for val in other.llvm.global_values:
@@ -224,6 +281,7 @@ class Module(S.Scope):
         g = ir.GlobalVariable(self.llvm, val.type.pointee, name=val.name)
         g.linkage = 'available_externally'
         g.initializer = val.initializer
+        g.global_constant = val.global_constant
 
   # import the scope from other modules
   def import_scope(self, other):
@@ -243,7 +301,7 @@ class Module(S.Scope):
     with self.stack('ret_ptr', 'bind_ptr', 'arg_ptrs', 'landingpad', 'bindings'):
       entry = func.append_basic_block('entry')
       body = func.append_basic_block('body')
-      self.bindings = set()
+      self.bindings = OrderedSet()  # ordered so the IR is deterministic
       self.ret_ptr = func.args[0]
       self.arg_ptrs = []
       self.landingpad = None
@@ -301,16 +359,43 @@ class Module(S.Scope):
       yield
 
   @contextmanager
-  def trace(self, pos, mod=None):
+  def trace(self, pos, mod=None, call=False):
+    '''Record a position on the trace stack while emitting the body.
+
+    With full tracing, every operation calls into the runtime to push and pop
+    its position. Lite tracing only records calls, and stores the records
+    inline. With tracing off, nothing is recorded, and the runtime walks the
+    native stack instead when there's a panic.'''
+    if self.tracing == 'off' or (self.tracing == 'lite' and not call):
+      yield
+      return
+
     label = mod or self.name_ptr
     line, col = TRACE_UNKNOWN, TRACE_UNKNOWN
 
     if pos:
       line, col = pos.line, pos.col
 
-    self.builder.call(self.runtime['push'], (label, T.i32(line), T.i32(col)))
+    if self.tracing == 'full':
+      self.builder.call(self.runtime['push'], (label, T.i32(line), T.i32(col)))
+      yield
+      self.builder.call(self.runtime['pop'], ())
+      return
+
+    # the trace stack is a ring, so deep recursion overwrites the oldest records
+    depth = self.load(self.trace_depth)
+    idx = self.builder.and_(depth, T.i32(T.TRACE_SIZE - 1))
+    record = self.builder.gep(self.traces, [T.i32(0), idx])
+
+    for i, val in enumerate((label, T.i32(line), T.i32(col))):
+      self.store(val, self.builder.gep(record, [T.i32(0), T.i32(i)]))
+
+    self.store(self.builder.add(depth, T.i32(1)), self.trace_depth)
     yield
-    self.builder.call(self.runtime['pop'], ())
+
+    # landing pads can branch past the push, so depth might not dominate this
+    depth = self.load(self.trace_depth)
+    self.store(self.builder.sub(depth, T.i32(1)), self.trace_depth)
 
   # Box helpers ###############################################################
 
@@ -461,3 +546,64 @@ class Module(S.Scope):
       values.append(value)
 
     return values
+
+
+# Exports #####################################################################
+
+class ExportPickler(pickle.Pickler):
+  '''Pickle the globals of a module, without any function bodies.'''
+
+  def persistent_id(self, obj):
+    if isinstance(obj, ir.Module):
+      return ('module',)
+    elif isinstance(obj, ir.Function):
+      return ('func', obj.name, obj.ftype)
+    elif isinstance(obj, ir.IdentifiedStructType):
+      return ('type', obj.name)
+    elif isinstance(obj, A.node):
+      return ('node', A.pack(obj))
+
+
+class ExportUnpickler(pickle.Unpickler):
+  '''Load pickled globals into an empty module.'''
+
+  def __init__(self, file, module):
+    super().__init__(file)
+    self.module = module
+
+  def persistent_load(self, pid):
+    if pid[0] == 'module':
+      return self.module.llvm
+    elif pid[0] == 'func':
+      return self.module.find_func(pid[2], pid[1])
+    elif pid[0] == 'type':
+      return ir.global_context.get_identified_type(pid[1])
+    elif pid[0] == 'node':
+      return A.unpack(pid[1])
+
+    raise pickle.UnpicklingError('Unknown persistent id {!r}'.format(pid[0]))
+
+
+def pack_exports(module):
+  '''Serialize everything that an importer needs from a module.
+
+  That's the global scope and a declaration of every global value. Function
+  bodies are left out, so the result can only be imported, not compiled.'''
+  data = io.BytesIO()
+  ExportPickler(data, protocol=pickle.HIGHEST_PROTOCOL).dump(
+    (module.globals, list(module.llvm.global_values)))
+  return data.getvalue()
+
+
+def unpack_exports(data, file):
+  '''Load a module that was serialized with pack_exports().'''
+  module = Module(file)
+  scope, values = ExportUnpickler(io.BytesIO(data), module).load()
+
+  # keep the original order, so importers emit the same IR either way
+  llvm_globals = module.llvm.globals
+  for val in values:
+    llvm_globals[val.name] = llvm_globals.pop(val.name, val)
+
+  module.globals.update(scope)
+  return module
@@ -3,12 +3,15 @@ from . import compiler as C
 from . import engine as E
 from . import error as Q
 from . import module as M
+from . import timing as Z
 from . import token as K
 from . import types as T
 from ctypes import byref
 from os import environ as ENV
 from os.path import join
+from termcolor import colored as X
 import os.path
+import threading
 
 end = K.end_token()
 indent = K.indent_token()
@@ -34,6 +37,9 @@ binary_ops = {
 
   '&': 30,
   '|': 30,
+
+  # only parsed, for macros like base/macros.rn's case
+  '->': 10,
 }
 
 rassoc = {
@@ -44,8 +50,19 @@ rassoc = {
 class macro:
   def __init__(self, ctx, name, node, parses):
     self.name = name
+    self.node = node
     self.parses = parses
     self.ctx = ctx  # save this as our "source" context
+    self.compiled = False
+
+  def compile(self):
+    '''JIT compile the macro. This is deferred until it's first expanded.'''
+    if self.compiled:
+      return
+    self.compiled = True
+
+    ctx = self.ctx
+    node = self.node
 
     mod = M.Module(self.name)
     mod.file = ctx.file
@@ -85,21 +102,35 @@ class macro:
     return [fn(ctx) for fn in self.parses]
 
   def expand(self, ctx):
+    with Z.phase(self.ctx.qname, 'macro compile'):
+      self.compile()
+
     args = self.parse(ctx)
 
-    arg_boxes = [self.ctx.eng.to_rain(arg) for arg in args]
+    # every box made for this expansion is released when it's done. the
+    # return and argument boxes live in one array that the GC scans as a root
+    with T.arena() as scope:
+      boxes = T.cbox.array(len(args) + 1)
+
+      with self.ctx.eng.rooted(boxes):
+        for i, arg in enumerate(args):
+          self.ctx.eng.to_rain(arg, boxes[i + 1])
 
-    ret_box = T.cbox(0, 0, 0)
-    args = [T.carg] * (len(self.parses) + 1)
+        types = [T.carg] * len(boxes)
+        func = self.ctx.eng.get_func('macro.func.main:' + self.name, None, *types)
+        func(*[byref(box) for box in boxes])
 
-    func = self.ctx.eng.get_func('macro.func.main:' + self.name, None, *args)
-    func(byref(ret_box), *[byref(arg) for arg in arg_boxes])
+        new_node = self.ctx.eng.to_py(boxes[0])
 
-    new_node = self.ctx.eng.to_py(ret_box)
+    C.Compiler.vprint('{:>10} {} held {} boxes, {} buffers, {} bytes', 'expanded',
+                      X(self.name, 'green'), scope.boxes, scope.buffers, scope.bytes)
 
     return new_node
 
 
+merging = threading.local()  # contexts being merged on this thread
+
+
 class context:
   def __init__(self, stream, *, file=None):
     self.file = file
@@ -110,16 +141,19 @@ class context:
     self._so = None
 
     self.token = None
+    self.prev = None
+    self.prev_idx = None
     self.stream = stream
     self.peek = next(stream)
     self.next()
-    self.past = []
 
     self.macros = {}
+    self.pending = []  # imports whose macros haven't been merged yet
+    self.merge_lock = threading.Lock()
 
   def next(self):
-    if self.token:
-      self.past.append(self.token.pos(file=self.file))
+    self.prev = self.token
+    self.prev_idx = None
 
     self.token = self.peek
     try:
@@ -127,12 +161,22 @@ class context:
     except StopIteration:
       self.peek = K.end_token()
 
+  @property
+  def last(self):
+    '''The position of the last consumed token, as a position table index.
+
+    Positions are only added to the table when a node asks for them.'''
+    if self.prev_idx is None:
+      pos = self.prev.pos
+      self.prev_idx = K.positions.add(pos.line, pos.col, pos.len, self.file)
+    return self.prev_idx
+
   @property
   def builtin_mod(self):
     if self._builtin is None:
       # compile builtins
       self._builtin = C.get_compiler(join(ENV['RAINLIB'], '_pkg.rn'))
-      self._builtin.build()
+      self._builtin.exports()
       self._builtin.compile_links()
 
     return self._builtin
@@ -147,24 +191,62 @@ class context:
   @property
   def eng(self):
     if not self._eng:
-      self._eng = E.Engine()
-      self._eng.add_lib(self.libs)
+      self._eng = E.Engine(cache=C.Compiler.cache)
+      if C.Compiler.runtime == 'ir':
+        self._eng.add_lib(self.libs)
+      else:
+        # the prebuilt runtime already depends on the builtin libraries
+        self._eng.add_lib(C.runtime_lib('shared'))
 
       self._eng.add_file(self.builtin_mod.ll, *self.builtin_mod.links)
-      self._eng.finalize()
       self._eng.init_gc()
-
-      # the GC needs to be disabled for some reason, otherwise it will
-      # sometimes collect things from inside other modules
-      self._eng.disable_gc()
+      self._eng.finalize()
 
     return self._eng
 
   def register_macro(self, name, node, parses):
-    self.macros[name] = macro(self, self.qname + ':' + name, node, parses)
+    with Z.phase(self.qname, 'macro define'):
+      self.macros[name] = macro(self, self.qname + ':' + name, node, parses)
 
   def expand_macro(self, name):
-    return self.macros[name].expand(self)
+    with Z.phase(self.qname, 'macro expand'):
+      return C.on_main(self.macros[name].expand, self)
+
+  def add_import(self, comp, prefix):
+    '''Start parsing an imported module and queue up its macros.'''
+    comp.prefetch()
+    with self.merge_lock:
+      self.pending.append((prefix, comp))
+
+  def merge_imports(self, name=None):
+    '''Merge the macros of pending imports into this module's macros.
+
+    With a macro name, only the imports under that name's prefix are merged.
+    This waits for the imported modules to be parsed.'''
+    active = merging.__dict__.setdefault('active', set())
+    if self in active:
+      return  # an import cycle; use the macros merged so far
+
+    prefix = name.split('.')[0] if name else None
+    with self.merge_lock:
+      todo = [item for item in self.pending if prefix in (None, item[0])]
+
+    # get the macros without holding the lock, since that can wait on other
+    # threads that need to merge into this module in an import cycle
+    active.add(self)
+    try:
+      tables = [(item, item[1].macros) for item in todo]
+    finally:
+      active.discard(self)
+
+    with self.merge_lock:
+      for item, table in tables:
+        if item not in self.pending:
+          continue
+
+        self.pending.remove(item)
+        for key, val in table.items():
+          self.macros[item[0] + '.' + key] = val
 
   def expect(self, *tokens):
     return self.token in tokens
@@ -253,7 +335,7 @@ def stmt(ctx):
     ctx.require(K.symbol_token('='))
     name = ctx.require(K.name_token).value
     node = A.export_foreign_node(name, rename)
-    node.coords = ctx.past[-1]
+    node.coords = ctx.last
     return node
 
   if ctx.consume(K.keyword_token('import')):
@@ -266,59 +348,36 @@ def stmt(ctx):
         rename = None
 
     name = import_mod(ctx, start=start)
-    pos = ctx.past[-1]
+    pos = ctx.last
 
     base, fname = os.path.split(ctx.file)
     file = M.find_rain(name, paths=[base])
 
     if not file:
-      Q.abort("Can't find module {!r}", name, pos=pos(file=ctx.file))
+      Q.abort("Can't find module {!r}", name, pos=K.positions.get(pos))
 
     if ctx.consume(K.keyword_token('as')):
       rename = ctx.require(K.name_token).value
 
-    comp = C.get_compiler(file)
-    comp.read()
-    comp.lex()
-    comp.parse()
-
-    prefix = rename or comp.mname
-    for key, val in comp.parser.macros.items():
-      ctx.macros[prefix + '.' + key] = val
+    import_macros(ctx, file, rename)
 
     node = A.import_node(name, rename)
     node.coords = pos
     return node
 
   if ctx.consume(K.keyword_token('macro')):
-    type_options = {
-      'compound': compound,
-      'expr': binexpr,
-      'args': fnargs,
-      'params': fnparams,
-      'block': block,
-      'argblock': fnargblock,
-      'stmt': stmt,
-      'name': lambda x: x.require(K.name_token).value,
-      'namestr': lambda x: x.require(K.name_token, K.string_token).value,
-      'str': lambda x: x.require(K.string_token).value,
-      'int': lambda x: x.require(K.int_token).value,
-      'float': lambda x: x.require(K.float_token).value,
-      'bool': lambda x: x.require(K.bool_token).value,
-    }
-
     name = ctx.require(K.name_token)
     if name.value in ctx.macros:
       Q.abort('Redefinition of macro {!r}', name.value, pos=name.pos(file=ctx.file))
 
     name = name.value
-    types = fnparams(ctx, tokens=[K.name_token(n) for n in type_options])
+    types = fnparams(ctx, tokens=[K.name_token(n) for n in macro_types])
     ctx.require(K.keyword_token('as'))
     params = fnparams(ctx)
     body = block(ctx)
 
     node = A.macro_node(name, types, params, body)
-    ctx.register_macro(name, node, [type_options[x] for x in types])
+    ctx.register_macro(name, node, [macro_types[x] for x in types])
     return node
 
   if ctx.expect(K.symbol_token('@')):
@@ -327,7 +386,7 @@ def stmt(ctx):
   if ctx.consume(K.keyword_token('link')):
     name = ctx.require(K.string_token).value
     node = A.link_node(name)
-    node.coords = ctx.past[-1]
+    node.coords = ctx.last
     return node
 
   if ctx.consume(K.keyword_token('library')):
@@ -415,7 +474,7 @@ def stmt(ctx):
 
   if ctx.consume(K.symbol_token(':')):
     name = ctx.require(K.name_token).value
-    pos = ctx.past[-1]
+    pos = ctx.last
     rhs = A.str_node(name)
     args = fnargs(ctx)
     node = A.meth_node(lhs, rhs, args)
@@ -460,6 +519,27 @@ def if_stmt(ctx):
   return A.if_node(pred, body, els)
 
 
+def import_macros(ctx, file, rename=None):
+  '''Make the macros of an imported module available under its name.
+
+  They're merged when a macro under that name is first expanded, so that the
+  module can be parsed in the background until then.'''
+  comp = C.get_compiler(file)
+  ctx.add_import(comp, rename or comp.mname)
+
+
+def load_macros(ctx, program):
+  '''Register the macros of a program that was loaded instead of parsed.'''
+  base, fname = os.path.split(ctx.file)
+
+  for node in program.stmts:
+    if isinstance(node, A.import_node):
+      import_macros(ctx, M.find_rain(node.name, paths=[base]), node.rename)
+
+    elif isinstance(node, A.macro_node):
+      ctx.register_macro(node.name, node, [macro_types[x] for x in node.types])
+
+
 # macro_exp :: '@' NAME ('.' NAME)* ***
 def macro_exp(ctx):
   ctx.require(K.symbol_token('@'))
@@ -471,6 +551,7 @@ def macro_exp(ctx):
     name += '.' + ctx.require(K.name_token).value
     pos.len = len(name)
 
+  ctx.merge_imports(name)
   if name not in ctx.macros:
     Q.abort('Unknown macro {!r}', name, pos=pos)
 
@@ -492,7 +573,7 @@ def var_prefix(ctx):
     return lst
 
   node = A.name_node(ctx.require(K.name_token).value)
-  node.coords = ctx.past[-1]
+  node.coords = ctx.last
   return node
 
 
@@ -633,7 +714,7 @@ def compound(ctx):
     return macro_exp(ctx)
 
   if ctx.consume(K.keyword_token('func')):
-    pos = ctx.past[-1]
+    pos = ctx.last
     rename = None
     if ctx.expect(K.name_token, K.string_token):
       rename = ctx.require(K.name_token, K.string_token).value
@@ -661,41 +742,47 @@ def compound(ctx):
 
 
 # binexpr :: unexpr (OPERATOR unexpr)*
+#
+# this is precedence climbing with explicit stacks instead of recursion, so
+# long chains of operators parse in linear time and at any length
 def binexpr(ctx):
-  lhs = unexpr(ctx)
-  pairs = []
+  operands = [unexpr(ctx)]
+  ops = []
 
   while ctx.expect(K.operator_token):
     op = ctx.require(K.operator_token)
     op.pos = op.pos(file=ctx.file)
-    pairs.append((op, unexpr(ctx)))
+    if op.value not in binary_ops:
+      Q.abort('Invalid binary operator {!r}', op.value, pos=op.pos)
 
-  if pairs:
-    lhs = bin_merge(lhs, pairs)
+    # finish every pending operator that binds at least as tightly as this one
+    prec = binary_ops[op.value]
+    while ops and bin_binds(ops[-1].value, prec, op.value):
+      bin_reduce(operands, ops)
 
-  return lhs
+    ops.append(op)
+    operands.append(unexpr(ctx))
 
+  while ops:
+    bin_reduce(operands, ops)
 
-def bin_merge(lhs, pairs):
-  op, rhs = pairs[0]
-  pairs = pairs[1:]
-  for nop, next in pairs:
-    if binary_ops[nop.value] > binary_ops[op.value]:
-      rhs = bin_merge(rhs, pairs)
-      break
-    elif nop.value in rassoc and binary_ops[nop.value] == binary_ops[op.value]:
-      rhs = bin_merge(rhs, pairs)
-      break
-    else:
-      lhs = A.binary_node(lhs, rhs, op.value)
-      lhs.coords = op.pos
-      op = nop
-      rhs = next
-      pairs = pairs[1:]
+  return operands[0]
+
+
+def bin_binds(left, prec, right):
+  if binary_ops[left] == prec:
+    return right not in rassoc
+  return binary_ops[left] > prec
+
+
+def bin_reduce(operands, ops):
+  op = ops.pop()
+  rhs = operands.pop()
+  lhs = operands.pop()
 
   node = A.binary_node(lhs, rhs, op.value)
   node.coords = op.pos
-  return node
+  operands.append(node)
 
 
 # unexpr :: ('-' | '!') simple
@@ -703,7 +790,7 @@ def bin_merge(lhs, pairs):
 def unexpr(ctx):
   if ctx.expect(K.operator_token('-'), K.operator_token('!')):
     op = ctx.require(K.operator_token).value
-    pos = ctx.past[-1]
+    pos = ctx.last
     node = A.unary_node(op, simple(ctx))
     node.coords = pos
     return node
@@ -718,7 +805,7 @@ def unexpr(ctx):
 #         | primary
 def simple(ctx):
   if ctx.consume(K.keyword_token('func')):
-    pos = ctx.past[-1]
+    pos = ctx.last
     params = fnparams(ctx)
     ctx.require(K.operator_token('->'))
     exp = binexpr(ctx)
@@ -762,7 +849,7 @@ def primary(ctx):
 
     if ctx.consume(K.symbol_token(':')):
       name = ctx.require(K.name_token).value
-      pos = ctx.past[-1]
+      pos = ctx.last
       rhs = A.str_node(name)
 
       catch = bool(ctx.consume(K.symbol_token('?')))
@@ -817,7 +904,7 @@ def prefix(ctx):
     node = A.table_node()
 
     if ctx.expect(K.symbol_token('{')):
-      pos = ctx.past[-1]
+      pos = ctx.last
       node = A.dict_node(dict_expr(ctx), set_meta=False)
       node.coords = pos
       return node
@@ -825,5 +912,23 @@ def prefix(ctx):
   else:
     node = A.name_node(ctx.require(K.name_token).value)
 
-  node.coords = ctx.past[-1]
+  node.coords = ctx.last
   return node
+
+
+# the parsers available to macro parameters
+macro_types = {
+  'compound': compound,
+  'expr': binexpr,
+  'args': fnargs,
+  'params': fnparams,
+  'block': block,
+  'argblock': fnargblock,
+  'stmt': stmt,
+  'name': lambda x: x.require(K.name_token).value,
+  'namestr': lambda x: x.require(K.name_token, K.string_token).value,
+  'str': lambda x: x.require(K.string_token).value,
+  'int': lambda x: x.require(K.int_token).value,
+  'float': lambda x: x.require(K.float_token).value,
+  'bool': lambda x: x.require(K.bool_token).value,
+}
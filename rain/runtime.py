@@ -44,6 +44,39 @@ externs = {
   'rain_get_ptr': T.func(T.arg, [T.arg, T.arg]),
   'rain_put': T.bin,
   'rain_get': T.bin,
+  'rain_put_hashed': T.vfunc(T.arg, T.arg, T.arg, T.i64),
+  'rain_get_hashed': T.vfunc(T.arg, T.arg, T.arg, T.i64),
+  'rain_get_ic': T.vfunc(T.arg, T.arg, T.arg, T.ptr(T.ic)),
+}
+
+
+# function attributes that are known to be valid for the runtime functions
+# anything that can call rain_panic (or a Rain function) must not be nounwind
+# table lookups aren't readonly, since rain_hash caches string hashes in the key
+attributes = {
+  'GC_malloc': ('nounwind',),
+  'GC_init': ('nounwind',),
+
+  'rain_abort': ('noreturn', 'nounwind'),
+  'rain_box_malloc': ('nounwind',),
+  'rain_box_to_exit': ('nounwind', 'readonly', 'argmemonly'),
+  'rain_catch': ('nounwind',),
+  'rain_init_args': ('nounwind',),
+  'rain_panic': ('noreturn',),
+
+  'rain_push': ('nounwind',),
+  'rain_pop': ('nounwind',),
+  'rain_dump': ('nounwind',),
+
+  'rain_lnot': ('nounwind',),
+  'rain_and': ('nounwind', 'argmemonly'),
+  'rain_or': ('nounwind', 'argmemonly'),
+
+  'rain_eq': ('nounwind',),
+  'rain_ne': ('nounwind',),
+
+  'rain_new_table': ('nounwind',),
+  'rain_get_ptr': ('nounwind',),
 }
 
 
@@ -53,7 +86,9 @@ class Runtime:
 
   def declare(self):
     for name, typ in externs.items():
-      self.module.add_func(typ, name=name)
+      func = self.module.add_func(typ, name=name)
+      for attr in attributes.get(name, ()):
+        func.attributes.add(attr)
 
   def _getfunc(self, name):
     return self.module.get_global(name)
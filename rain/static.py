@@ -1,3 +1,4 @@
+from . import ast as A
 from . import error as Q
 from . import types as T
 from llvmlite import ir
@@ -15,7 +16,10 @@ class Static:
 
     max = lpt_ptr.initializer.constant[1].constant
     items = arr_ptr.initializer.constant
-    key_hash = key_node.hash()
+    if isinstance(key_node, A.str_node):
+      key_hash = self.module.string_hash(key_node.value)
+    else:
+      key_hash = key_node.hash()
 
     while True:
       if not isinstance(items[key_hash % max], ir.GlobalVariable):
@@ -54,7 +58,7 @@ class Static:
 
       # reassign them
       lpt_ptr.arr_ptr = new_arr_ptr
-      lpt_ptr.initializer = T.lpt([T.i32(0), T.i32(max * 2), new_arr_gep])
+      lpt_ptr.initializer = T.lpt([T.i32(0), T.i32(max * 2), new_arr_gep, T.i64(0)])
 
       # reinsert everything
       for i, ipair in enumerate(old_items):
@@ -85,7 +89,7 @@ class Static:
     arr_ptr.initializer = arr_ptr.value_type(items)
     arr_gep = arr_ptr.gep([T.i32(0), T.i32(0)])
 
-    lpt_ptr.initializer = lpt_ptr.value_type([T.i32(cur), T.i32(max), arr_gep])
+    lpt_ptr.initializer = lpt_ptr.value_type([T.i32(cur), T.i32(max), arr_gep, T.i64(0)])
     lpt_ptr.arr_ptr = arr_ptr
 
     ret = items[idx].gep([T.i32(0), T.i32(1)])
@@ -110,7 +114,7 @@ class Static:
 
     lpt_typ = T.lpt
     lpt_ptr = self.module.add_global(lpt_typ, name=name)
-    lpt_ptr.initializer = lpt_typ([T.i32(0), T.i32(size), arr_gep])
+    lpt_ptr.initializer = lpt_typ([T.i32(0), T.i32(size), arr_gep, T.i64(0)])
     lpt_ptr.arr_ptr = arr_ptr
 
     return lpt_ptr
@@ -0,0 +1,169 @@
+from contextlib import contextmanager
+import json
+import threading
+import time
+import tracemalloc
+
+enabled = False
+records = {}  # (module, phase) -> record
+lock = threading.Lock()
+local = threading.local()
+
+# thread_time() is new in Python 3.7 and reset_peak() in 3.9. without them,
+# CPU time includes every thread and memory is measured at the end of a phase
+thread_time = getattr(time, 'thread_time', time.process_time)
+can_reset_peak = hasattr(tracemalloc, 'reset_peak')
+
+
+class record:
+  def __init__(self, module, phase):
+    self.module = module
+    self.phase = phase
+    self.count = 0
+    self.wall = 0.0
+    self.cpu = 0.0
+    self.peak = 0
+
+  def as_dict(self):
+    return {
+      'module': self.module,
+      'phase': self.phase,
+      'count': self.count,
+      'wall': self.wall,
+      'cpu': self.cpu,
+      'peak': self.peak,
+    }
+
+
+class frame:
+  def __init__(self):
+    self.wall = time.perf_counter()
+    self.cpu = thread_time()
+    self.mem = 0
+    self.peak = 0
+    self.child_wall = 0.0
+    self.child_cpu = 0.0
+
+
+def enable():
+  '''Start recording phases.'''
+  global enabled
+  enabled = True
+  tracemalloc.start()
+
+
+def reset():
+  with lock:
+    records.clear()
+
+
+def main_thread():
+  return threading.current_thread() is threading.main_thread()
+
+
+def traced_memory():
+  '''Return the current memory and the peak since the last reset_peak().'''
+  current, peak = tracemalloc.get_traced_memory()
+  if not can_reset_peak:
+    peak = current
+
+  return current, peak
+
+
+@contextmanager
+def phase(module, name):
+  '''Record the wall time, CPU time and peak memory of a phase.
+
+  Times are exclusive: a phase that runs inside another one (like building an
+  import while emitting its importer) is only counted once, in the inner one.
+  Memory is only tracked on the main thread, since tracemalloc is global.'''
+  if not enabled:
+    yield
+    return
+
+  stack = getattr(local, 'stack', None)
+  if stack is None:
+    stack = local.stack = []
+
+  cur = frame()
+  if main_thread():
+    cur.mem, outer_peak = traced_memory()
+    if stack:
+      stack[-1].peak = max(stack[-1].peak, outer_peak)
+    if can_reset_peak:
+      tracemalloc.reset_peak()
+
+  stack.append(cur)
+  try:
+    yield
+  finally:
+    stack.pop()
+
+    wall = time.perf_counter() - cur.wall
+    cpu = thread_time() - cur.cpu
+
+    peak = 0
+    if main_thread():
+      peak = max(cur.peak, traced_memory()[1])
+      if stack:
+        stack[-1].peak = max(stack[-1].peak, peak)
+
+    if stack:
+      stack[-1].child_wall += wall
+      stack[-1].child_cpu += cpu
+
+    with lock:
+      key = (module, name)
+      if key not in records:
+        records[key] = record(module, name)
+
+      rec = records[key]
+      rec.count += 1
+      rec.wall += wall - cur.child_wall
+      rec.cpu += cpu - cur.child_cpu
+      rec.peak = max(rec.peak, peak - cur.mem)
+
+
+def sorted_records():
+  with lock:
+    return sorted(records.values(), key=lambda rec: rec.wall, reverse=True)
+
+
+def table():
+  '''Format the recorded phases as a table, slowest first.'''
+  rows = sorted_records()
+  width = max([len(rec.module) for rec in rows] + [6])
+
+  lines = ['{:<{}}  {:<14} {:>6} {:>10} {:>10} {:>10}'.format(
+    'module', width, 'phase', 'count', 'wall (s)', 'cpu (s)', 'peak (KB)')]
+
+  for rec in rows:
+    lines.append('{:<{}}  {:<14} {:>6} {:>10.4f} {:>10.4f} {:>10.1f}'.format(
+      rec.module, width, rec.phase, rec.count, rec.wall, rec.cpu, rec.peak / 1024))
+
+  total_wall = sum(rec.wall for rec in rows)
+  total_cpu = sum(rec.cpu for rec in rows)
+  lines.append('{:<{}}  {:<14} {:>6} {:>10.4f} {:>10.4f}'.format(
+    'total', width, '', '', total_wall, total_cpu))
+
+  return '\n'.join(lines)
+
+
+def dump(file):
+  '''Write the recorded phases to a JSON file.'''
+  with open(file, 'w') as tmp:
+    json.dump([rec.as_dict() for rec in sorted_records()], tmp, indent=2)
+
+
+def timed(module, name, iterator):
+  '''Record the time spent running a lazy iterator to its end.
+
+  The whole iterator runs in one phase, since timing each item on its own
+  costs about as much as producing it.'''
+  if not enabled:
+    return iterator
+
+  with phase(module, name):
+    items = list(iterator)
+
+  return iter(items)
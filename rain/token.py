@@ -1,4 +1,11 @@
+from array import array
+import sys
+import threading
+
+
 class coord:
+  __slots__ = ['line', 'col', 'file', 'len']
+
   def __init__(self, line=0, col=0, file=None, len=1):
     self.line = line
     self.col = col
@@ -28,7 +35,80 @@ class coord:
     return '<{!s}>'.format(self)
 
 
+class position_table:
+  '''A compact, array-backed table of source positions.
+
+  AST nodes keep an index into this table instead of a coord of their own.
+  File names are stored once and referenced by number. Indexes keep counting
+  up across clear(), so an index from before a clear is never reused.'''
+
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.lines = array('L')
+    self.cols = array('L')
+    self.lens = array('L')
+    self.files = array('L')
+    self.file_names = [None]
+    self.file_ids = {None: 0}
+    self.base = 0  # the index of the first position since the last clear
+
+  def __len__(self):
+    return len(self.lines)
+
+  def add(self, line, col, length=1, file=None):
+    '''Add a position to the table and return its index.'''
+    with self.lock:
+      if file not in self.file_ids:
+        self.file_ids[file] = len(self.file_names)
+        self.file_names.append(file)
+
+      self.lines.append(line)
+      self.cols.append(col)
+      self.lens.append(length)
+      self.files.append(self.file_ids[file])
+      return self.base + len(self.lines) - 1
+
+  def add_coord(self, pos):
+    return self.add(pos.line, pos.col, pos.len, pos.file)
+
+  def clear(self):
+    '''Forget every position. The old indexes will have no position.'''
+    with self.lock:
+      self.base += len(self.lines)
+      del self.lines[:]
+      del self.cols[:]
+      del self.lens[:]
+      del self.files[:]
+      self.file_names = [None]
+      self.file_ids = {None: 0}
+
+  def get(self, idx):
+    '''Return the position at an index as a coord, or None if it was cleared.'''
+    idx -= self.base
+    if idx < 0:
+      return None
+    return coord(self.lines[idx], self.cols[idx], self.file_names[self.files[idx]], self.lens[idx])
+
+
+positions = position_table()
+
+
 class metatoken(type):
+  def __call__(cls, *args, pos=None):
+    if pos is not None:
+      return super().__call__(*args, pos=pos)
+
+    # tokens without a position are only used for comparisons, so the ones
+    # that have few distinct values are shared
+    if not cls.interned:
+      return super().__call__(*args)
+
+    key = (cls,) + args
+    tok = cls.singletons.get(key)
+    if tok is None:
+      tok = cls.singletons.setdefault(key, super().__call__(*args))
+    return tok
+
   def __str__(self):
     if getattr(self, 'name', None):
       return self.name
@@ -40,6 +120,10 @@ class metatoken(type):
 
 
 class token(metaclass=metatoken):
+  __slots__ = ['pos']
+  interned = False
+  singletons = {}
+
   def __init__(self, *, pos=coord()):
     self.pos = pos
 
@@ -56,26 +140,34 @@ class token(metaclass=metatoken):
 
 
 class end_token(token):
+  __slots__ = []
   name = 'EOF'
 
 
 # Rain
 
 class indent_token(token):
+  __slots__ = []
   name = 'indent'
 
 
 class dedent_token(token):
+  __slots__ = []
   name = 'dedent'
 
 
 class newline_token(token):
+  __slots__ = []
   name = 'newline'
 
 
 class value_token(token):
+  __slots__ = ['value']
+
   def __init__(self, value, *, pos=coord()):
     super().__init__(pos=pos)
+    if self.interned:
+      value = sys.intern(value)
     self.value = value
 
   def __eq__(self, other):
@@ -93,22 +185,31 @@ class value_token(token):
 
 
 class keyword_token(value_token):
+  __slots__ = []
   name = 'keyword'
+  interned = True
 
 
 class name_token(value_token):
+  __slots__ = []
   name = 'name'
+  interned = True
 
 
 class symbol_token(value_token):
+  __slots__ = []
   name = 'symbol'
+  interned = True
 
 
 class operator_token(value_token):
+  __slots__ = []
   name = 'operator'
+  interned = True
 
 
 class int_token(value_token):
+  __slots__ = []
   name = 'int'
 
   def __init__(self, value, *, pos=coord()):
@@ -116,6 +217,7 @@ class int_token(value_token):
 
 
 class float_token(value_token):
+  __slots__ = []
   name = 'float'
 
   def __init__(self, value, *, pos=coord()):
@@ -123,6 +225,7 @@ class float_token(value_token):
 
 
 class bool_token(value_token):
+  __slots__ = []
   name = 'bool'
 
   def __init__(self, value, *, pos=coord()):
@@ -130,6 +233,7 @@ class bool_token(value_token):
 
 
 class string_token(value_token):
+  __slots__ = []
   name = 'string'
 
   def __init__(self, value, *, pos=coord()):
@@ -141,8 +245,8 @@ class string_token(value_token):
 
 
 class null_token(value_token):
-  pass
+  __slots__ = []
 
 
 class table_token(value_token):
-  pass
+  __slots__ = []
@@ -1,15 +1,19 @@
 from llvmlite import ir
 import ctypes as ct
 import struct
+import threading
 
 # indices into a box
 TYPE = 0
 SIZE = 1
 DATA = 2
 ENV = 3
+HASH = 4
 
 # sizes of things
 HASH_SIZE = 32
+IC_DEPTH = 4  # must match core.h
+TRACE_SIZE = 1024  # must be a power of two
 
 # all sorts of type aliases
 i8 = ir.IntType(8)
@@ -24,6 +28,8 @@ arr = ir.ArrayType
 box = ir.context.global_context.get_identified_type('box')
 item = ir.context.global_context.get_identified_type('item')
 lpt = ir.context.global_context.get_identified_type('table')
+ic = ir.context.global_context.get_identified_type('ic')
+trace = ir.context.global_context.get_identified_type('trace_record')
 arg = ptr(box)
 lp = ir.LiteralStructType([ptr(i8), i32])
 
@@ -33,9 +39,11 @@ def vfunc(*args, var_arg=False):
 
 
 # set struct bodies
-box.set_body(i8, i32, i64, arg)
+box.set_body(i8, i32, i64, arg, i64)
 item.set_body(box, box)
-lpt.set_body(i32, i32, ptr(ptr(item)))
+lpt.set_body(i32, i32, ptr(ptr(item)), i64)
+ic.set_body(i32, arr(ptr(lpt), IC_DEPTH), arr(i64, IC_DEPTH), box)
+trace.set_body(ptr(i8), i32, i32)
 
 # constant aliases
 null = box(None)
@@ -57,31 +65,31 @@ def insertvalue(container, value, idx):
 
 
 def _int(val, meta=arg(None)):
-  return box([ityp.int, i32(0), cast.int(val), meta])
+  return box([ityp.int, i32(0), cast.int(val), meta, i64(0)])
 
 
 def _float(val, meta=arg(None)):
   val = cast.float(val).bitcast(cast.int)
-  return box([ityp.float, i32(0), val, meta])
+  return box([ityp.float, i32(0), val, meta, i64(0)])
 
 
 def _bool(val, meta=arg(None)):
-  return box([ityp.bool, i32(0), cast.bool(int(val)), meta])
+  return box([ityp.bool, i32(0), cast.bool(int(val)), meta, i64(0)])
 
 
-def _str(ptr, size, meta=arg(None)):
-  return box([ityp.str, i32(size), ptrtoint(ptr), meta])
+def _str(ptr, size, meta=arg(None), hash=0):
+  return box([ityp.str, i32(size), ptrtoint(ptr), meta, i64(hash)])
 
 
 def _table(ptr):
-  return box([ityp.table, i32(0), ptrtoint(ptr), arg(None)])
+  return box([ityp.table, i32(0), ptrtoint(ptr), arg(None), i64(0)])
 
 
 def _func(ptr=None, args=0):
   if ptr:
-    return box([ityp.func, i32(args), ptrtoint(ptr), arg(None)])
+    return box([ityp.func, i32(args), ptrtoint(ptr), arg(None), i64(0)])
 
-  return box([ityp.func, i32(args), i64(0), arg(None)])
+  return box([ityp.func, i32(args), i64(0), arg(None), i64(0)])
 
 
 class cast:
@@ -116,20 +124,74 @@ class ityp:
   cdata = i8(typi.cdata)
 
 
+class arena:
+  '''Keep ctypes boxes and buffers alive until the end of a scope.
+
+  Anything created outside of an arena is saved in cbox._saves_ forever.
+  Arenas nest per thread, so parallel macro expansions don't share one.'''
+  local = threading.local()
+
+  @classmethod
+  def stack(cls):
+    if not hasattr(cls.local, 'stack'):
+      cls.local.stack = []
+    return cls.local.stack
+
+  def __init__(self):
+    self.saves = []
+    self.boxes = 0
+    self.buffers = 0
+    self.bytes = 0
+
+  def save(self, obj):
+    self.saves.append(obj)
+    self.bytes += ct.sizeof(obj)
+    if isinstance(obj, cbox):
+      self.boxes += 1
+    elif isinstance(obj, ct.Array) and obj._type_ is cbox:
+      self.boxes += len(obj)  # from cbox.array()
+    else:
+      self.buffers += 1
+
+  def __enter__(self):
+    arena.stack().append(self)
+    return self
+
+  def __exit__(self, *args):
+    arena.stack().pop()
+    self.saves = []
+
+
 class cbox(ct.Structure):
   _saves_ = []
 
   def __str__(self):
     env_p = ct.cast(self.env, ct.c_void_p).value or 0
-    return 'cbox({}, {}, 0x{:08x}, 0x{:08x})'.format(self.type, self.size, self.data, env_p)
+    return 'cbox({}, {}, 0x{:08x}, 0x{:08x}, 0x{:08x})'.format(
+      self.type, self.size, self.data, env_p, self.hash)
 
   def __repr__(self):
     return '<{!s}>'.format(self)
 
+  @classmethod
+  def save(cls, obj):
+    stack = arena.stack()
+    if stack:
+      stack[-1].save(obj)
+    else:
+      cls._saves_.append(obj)
+
   @classmethod
   def new(cls, *args, **kwargs):
     obj = cls(*args, **kwargs)
-    cls._saves_.append(obj)
+    cls.save(obj)
+    return obj
+
+  @classmethod
+  def array(cls, count):
+    '''Return a contiguous array of null boxes.'''
+    obj = (cls * count)()
+    cls.save(obj)
     return obj
 
   @classmethod
@@ -148,8 +210,8 @@ class cbox(ct.Structure):
       return cls.new(typi.float, 0, intrep, cls.null)
     elif isinstance(val, str):
       str_p = ct.create_string_buffer(val.encode('utf-8'))
-      cls._saves_.append(str_p)
-      return cls.new(typi.str, len(val), ct.cast(str_p, ct.c_void_p).value, cls.null)
+      cls.save(str_p)
+      return cls.new(typi.str, len(str_p) - 1, ct.cast(str_p, ct.c_void_p).value, cls.null)
 
     raise Exception("Can't convert value {!r} to Rain".format(val))
 
@@ -175,5 +237,6 @@ cbox._fields_ = [('type', ct.c_uint8),
                  ('size', ct.c_uint32),
                  ('data', ct.c_uint64),
                  ('env', carg),
+                 ('hash', ct.c_uint64),
                  ]
 cbox.null = carg()
@@ -12,7 +12,8 @@ setup(name='rainlang',
         'bin/rain',
         'bin/rainc',
         'bin/rain-help',
-        'bin/rain-compile'
+        'bin/rain-compile',
+        'bin/rain-run'
       ],
       include_package_data=True,
       install_requires=[
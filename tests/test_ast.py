@@ -0,0 +1,17 @@
+import rain.ast as A
+
+def test_str_hash():
+  # these match rain_hash_str in core/table/table.c
+  assert A.str_node('').hash() == 5381
+  assert A.str_node('get').hash() == 193492613
+  assert A.str_node('\xe9').hash() == 5866513  # hashed as UTF-8 bytes
+
+  # 64-bit wraparound
+  assert A.str_node('x' * 100).hash() < 2 ** 64
+
+def test_literal_hash():
+  # constant keys are hashed at compile time, so these must match rain_hash
+  assert A.int_node(-1).hash() == 2 ** 64 - 1
+  assert A.float_node(1.0).hash() == 0x3ff0000000000000
+  assert A.bool_node(True).hash() == 1
+  assert A.null_node().hash() == 0
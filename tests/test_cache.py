@@ -0,0 +1,186 @@
+import os
+import os.path
+import rain.ast as A
+import rain.cache as H
+import rain.compiler as C
+import rain.error as Q
+import rain.module as M
+import pytest
+
+
+if 'RAINHOME' not in os.environ:
+  os.environ['RAINHOME'] = os.path.normpath(os.path.join(__file__, '../../'))
+
+if 'RAINLIB' not in os.environ:
+  os.environ['RAINLIB'] = os.path.join(os.environ['RAINHOME'], 'core')
+
+if 'RAINBASE' not in os.environ:
+  os.environ['RAINBASE'] = os.path.join(os.environ['RAINHOME'], 'base')
+
+
+def write(path, data):
+  with open(str(path), 'w') as tmp:
+    tmp.write(data)
+
+  return str(path)
+
+def test_key(tmpdir):
+  main = write(tmpdir.join('main.rn'), 'import lib\n')
+  lib = write(tmpdir.join('lib.rn'), 'var x = 1\n')
+
+  cache = H.Cache(str(tmpdir.join('cache')))
+  assert cache.key(main) is None
+
+  cache.set_deps(lib)
+  cache.set_deps(main, imports=[lib])
+  old_key = cache.key(main)
+  assert old_key is not None
+  assert cache.key(main, 'main') != old_key
+
+  # changing an import changes the key
+  write(tmpdir.join('lib.rn'), 'var x = 2\n')
+  cache = H.Cache(str(tmpdir.join('cache')))
+  cache.set_deps(lib)
+  assert cache.key(main) != old_key
+
+def test_get_put(tmpdir):
+  src = write(tmpdir.join('main.ll'), 'IR')
+
+  cache = H.Cache(str(tmpdir.join('cache')))
+  assert cache.get('abc', 'main.ll') is None
+  assert cache.get(None, 'main.ll') is None
+
+  path = cache.put('abc', 'main.ll', src)
+  assert cache.get('abc', 'main.ll') == path
+  with open(path) as tmp:
+    assert tmp.read() == 'IR'
+
+  stats = cache.stats()
+  assert stats['hits'] == 1
+  assert stats['misses'] == 2
+  assert stats['entries'] == 1
+  assert stats['size'] == 2
+
+def test_evict(tmpdir):
+  src = write(tmpdir.join('main.ll'), 'x' * 100)
+
+  cache = H.Cache(str(tmpdir.join('cache')), max_size=250)
+  cache.put('a', 'main.ll', src)
+  cache.put('b', 'main.ll', src)
+  os.utime(cache.entry_path('a'), (0, 0))
+  os.utime(cache.entry_path('b'), (1, 1))
+
+  cache = H.Cache(str(tmpdir.join('cache')), max_size=250)  # a new build
+  cache.get('a', 'main.ll')  # a is now more recent than b
+  cache.put('c', 'main.ll', src)
+
+  assert cache.get('a', 'main.ll')
+  assert cache.get('b', 'main.ll') is None
+  assert cache.get('c', 'main.ll')
+  assert cache.evictions == 1
+  assert cache.size == 200
+
+def test_evict_pinned(tmpdir):
+  src = write(tmpdir.join('main.ll'), 'x' * 100)
+
+  # everything this build touched stays, even over the limit
+  cache = H.Cache(str(tmpdir.join('cache')), max_size=250)
+  for key in 'abc':
+    cache.put(key, 'main.ll', src)
+
+  assert all(cache.get(key, 'main.ll') for key in 'abc')
+  assert cache.evictions == 0
+  assert cache.size == 300
+
+def test_pack(tmpdir):
+  src = write(tmpdir.join('main.rn'), 'var x = {a = 1, [2] = 3.5}\nvar y = func(a, b) -> a + b * -2\n')
+
+  C.reset_compilers()
+  comp = C.get_compiler(src)
+  comp.parse()
+
+  data = A.pack(comp.ast)
+  ast = A.unpack(data)
+  assert A.machine.dump(ast) == A.machine.dump(comp.ast)
+  assert ast.stmts[1].rhs.coords.line == 2
+
+  with pytest.raises(ValueError):
+    A.unpack(b'garbage')
+
+def test_reset_positions(tmpdir):
+  src = write(tmpdir.join('main.rn'), 'var x = 1\nvar y = x\n')
+
+  cache = C.Compiler.cache
+  C.Compiler.cache = H.Cache(str(tmpdir.join('cache')))
+  try:
+    C.reset_compilers()
+    comp = C.get_compiler(src)
+    comp.parse()
+    C.Compiler.cache.set_deps(src)
+    comp.store_ast()
+
+    C.reset_compilers()
+    comp = C.get_compiler(src)
+    comp.parse()
+    assert comp.parser is None  # loaded from the cache
+
+    # a compiler that's still held keeps its positions through a reset
+    C.reset_compilers()
+    pos = comp.ast.stmts[1].rhs.coords
+    assert (pos.line, pos.col, pos.file) == (2, 9, src)
+
+    # once it's dropped, its AST has no positions, but errors still work
+    ast = comp.ast
+    del comp
+    C.reset_compilers()
+    assert ast.stmts[1].rhs.coords is None
+    with pytest.raises(SystemExit):
+      Q.abort('Unknown name {!r}', 'x', pos=ast.stmts[1].rhs.coords)
+
+  finally:
+    C.Compiler.cache = cache
+    C.reset_compilers()
+
+def test_exports(tmpdir):
+  src = write(tmpdir.join('lib.rn'), 'var x = 1\nvar f = func(a) -> a + x\nmodule = table {f = f}\n')
+
+  C.reset_compilers()
+  comp = C.get_compiler(src)
+  comp.emit()
+
+  mod = M.unpack_exports(M.pack_exports(comp.mod), src)
+  assert list(mod.globals) == list(comp.mod.globals)
+  assert list(mod.llvm.globals) == list(comp.mod.llvm.globals)
+  assert str(mod['x'].initializer) == str(comp.mod['x'].initializer)
+  assert str(mod['module'].initializer) == str(comp.mod['module'].initializer)
+
+def test_build_imports(tmpdir):
+  write(tmpdir.join('c.rn'), 'var base = func(x)\n  return x + 1\n')
+  for name in 'ab':
+    write(tmpdir.join(name + '.rn'), 'import c\n\nvar f = func(x)\n  return c.base(x)\n\nmodule = table {f = f}\n')
+  main = write(tmpdir.join('main.rn'), 'import a\nimport b\n\nvar main = func()\n  print(a.f(1) + b.f(2))\n')
+
+  C.reset_compilers()
+  comp = C.get_compiler(main, main=True)
+  comp.emit()
+  serial = comp.mod.ir
+
+  cache, jobs = C.Compiler.cache, C.Compiler.jobs
+  C.Compiler.cache = H.Cache(str(tmpdir.join('cache')))
+  C.Compiler.jobs = 2
+  try:
+    C.reset_compilers()
+    comp = C.get_compiler(main, main=True)
+    comp.parse()
+    a, b, c = (str(tmpdir.join(name + '.rn')) for name in 'abc')
+    assert C.import_graph(comp) == {a: {c}, b: {c}, c: set()}
+
+    comp.emit()
+    assert comp.mod.ir == serial
+
+    # a, b, and c were built by workers, so they're imported from the cache
+    assert all(C.get_compiler(file).is_cached() for file in (a, b, c))
+
+  finally:
+    C.Compiler.cache, C.Compiler.jobs = cache, jobs
+    C.reset_compilers()
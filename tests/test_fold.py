@@ -0,0 +1,72 @@
+from llvmlite import ir
+import os
+import os.path
+import rain.ast as A
+import rain.compiler as C
+import rain.fold as F
+import rain.lexer as L
+import rain.parser as P
+
+
+if 'RAINHOME' not in os.environ:
+  os.environ['RAINHOME'] = os.path.normpath(os.path.join(__file__, '../../'))
+
+if 'RAINLIB' not in os.environ:
+  os.environ['RAINLIB'] = os.path.join(os.environ['RAINHOME'], 'core')
+
+if 'RAINBASE' not in os.environ:
+  os.environ['RAINBASE'] = os.path.join(os.environ['RAINHOME'], 'base')
+
+
+def fold_expr(src):
+  ctx = P.context(L.stream(src), file='test.rn')
+  return F.fold_tree(P.binexpr(ctx))
+
+def test_arithmetic():
+  assert fold_expr('1 + 2 * 3') == (A.int_node(7), 2)
+  assert fold_expr('7 / -2')[0] == A.int_node(-3)
+  assert fold_expr('1 + 0.5')[0] == A.float_node(1.5)
+  assert fold_expr('9223372036854775807 + 1')[0] == A.int_node(-9223372036854775808)
+  assert fold_expr('"a" $ "b" $ "c"')[0] == A.str_node('abc')
+
+  # these are left for the runtime to complain about
+  assert fold_expr('1 / 0')[1] == 0
+  assert fold_expr('1 + "a"')[1] == 0
+  assert fold_expr('"a" $ 1')[1] == 0
+
+def test_logic():
+  assert fold_expr('1 < 2')[0] == A.bool_node(True)
+  assert fold_expr('"b" < "a"')[0] == A.bool_node(False)
+  assert fold_expr('1 == 1.0')[0] == A.bool_node(False)
+  assert fold_expr('null == null')[0] == A.bool_node(True)
+  assert fold_expr('!""')[0] == A.bool_node(False)
+  assert fold_expr('!0')[0] == A.bool_node(True)
+
+  node, count = fold_expr('0 | x')
+  assert isinstance(node, A.name_node) and count == 1
+
+  node, count = fold_expr('x & 0')
+  assert isinstance(node, A.binary_node) and count == 0
+
+def test_if():
+  ctx = P.context(L.stream('if 1 < 2\n  f()\nelse\n  g()\n'), file='test.rn')
+  node, count = F.fold_tree(P.stmt(ctx))
+  assert isinstance(node, A.block_node)
+
+  # dropping the branch would drop the declaration of y
+  ctx = P.context(L.stream('if false\n  var y = 1\n'), file='test.rn')
+  node, count = F.fold_tree(P.stmt(ctx))
+  assert isinstance(node, A.if_node)
+
+def test_if_return(tmpdir):
+  src = tmpdir.join('main.rn')
+  src.write('var main = func()\n  if true\n    return 1\n  print("dead")\n')
+
+  C.reset_compilers()
+  comp = C.get_compiler(str(src), main=True)
+  comp.emit()
+
+  # the return ends its block, so the print after it needs a new one
+  for func in comp.mod.llvm.functions:
+    for block in func.blocks:
+      assert not any(isinstance(instr, ir.Terminator) for instr in block.instructions[:-1])
@@ -123,3 +123,58 @@ def test_prints():
   assert repr(K.end_token()) == '<EOF>'
   assert str(K.int_token(5)) == 'int 5'
   assert repr(K.int_token(5)) == '<int 5>'
+
+def test_positions():
+  stream = L.stream('let x = 10\n'
+                    '  f("a", -2.5) # comment\n'
+                    'y')
+
+  expected = [(1, 1, 3), (1, 5, 1), (1, 7, 1), (1, 9, 2),
+              (2, 1, 2), (2, 3, 1), (2, 4, 1), (2, 5, 3), (2, 8, 1), (2, 10, 4), (2, 14, 1),
+              (3, 1, 1), (3, 1, 1), (3, 1, 1), (3, 1, 1), (3, 2, 1)]
+
+  assert [(tok.pos.line, tok.pos.col, tok.pos.len) for tok in stream] == expected
+
+def test_concurrent():
+  from concurrent.futures import ThreadPoolExecutor
+
+  def source(n):
+    return ''.join('let f{0} = func(a,\n  b)\n  return [a,\n    b, {0}]\n'.format(i)
+                   for i in range(n))
+
+  def lex(src):
+    return [(str(tok), tok.pos.line, tok.pos.col) for tok in L.stream(src)]
+
+  sources = [source(n % 20 + 1) for n in range(300)]
+  expected = [lex(src) for src in sources]
+
+  # interleaved streams in one thread
+  streams = [L.stream(src) for src in sources]
+  results = [[] for src in sources]
+  done = False
+  while not done:
+    done = True
+    for stream, result in zip(streams, results):
+      tok = next(stream, None)
+      if tok is not None:
+        result.append((str(tok), tok.pos.line, tok.pos.col))
+        done = False
+
+  assert results == expected
+
+  # many threads
+  with ThreadPoolExecutor(16) as pool:
+    assert list(pool.map(lex, sources)) == expected
+
+def test_compact_tokens():
+  assert K.symbol_token('=') is K.symbol_token('=')
+  assert K.keyword_token('if') is K.keyword_token('if')
+  assert K.symbol_token('=', pos=K.coord(1, 1)) is not K.symbol_token('=')
+
+  idx = K.positions.add(3, 4, 5, 'file.rn')
+  pos = K.positions.get(idx)
+  assert (pos.line, pos.col, pos.len, pos.file) == (3, 4, 5, 'file.rn')
+
+  K.positions.clear()
+  assert len(K.positions) == 0
+  assert K.positions.get(K.positions.add(1, 2, 3, 'file.rn')).file == 'file.rn'
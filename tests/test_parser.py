@@ -0,0 +1,73 @@
+import os
+import os.path
+import rain.ast as A
+import rain.compiler as C
+import rain.lexer as L
+import rain.parser as P
+import threading
+
+
+if 'RAINHOME' not in os.environ:
+  os.environ['RAINHOME'] = os.path.normpath(os.path.join(__file__, '../../'))
+
+if 'RAINLIB' not in os.environ:
+  os.environ['RAINLIB'] = os.path.join(os.environ['RAINHOME'], 'core')
+
+if 'RAINBASE' not in os.environ:
+  os.environ['RAINBASE'] = os.path.join(os.environ['RAINHOME'], 'base')
+
+
+def parse_expr(src):
+  ctx = P.context(L.stream(src), file='test.rn')
+  return P.binexpr(ctx)
+
+def shape(node):
+  if isinstance(node, A.binary_node):
+    return (shape(node.lhs), node.op, shape(node.rhs))
+  return node.value
+
+def test_precedence():
+  assert shape(parse_expr('a - b * c - d')) == ((('a', '-', ('b', '*', 'c')), '-', 'd'))
+  assert shape(parse_expr('a == b + c & d')) == (('a', '==', ('b', '+', 'c')), '&', 'd')
+  assert shape(parse_expr('a :: b :: c')) == ('a', '::', ('b', '::', 'c'))
+
+def test_arrow():
+  assert shape(parse_expr('x -> 1')) == ('x', '->', 1)
+  assert shape(parse_expr('a + 1 -> b | c')) == (('a', '+', 1), '->', ('b', '|', 'c'))
+
+def test_long_chain():
+  node = parse_expr(' $ '.join(['a'] * 20000))
+  depth = 0
+  while isinstance(node, A.binary_node):
+    assert node.rhs.value == 'a'
+    node = node.lhs
+    depth += 1
+
+  assert depth == 19999
+
+def test_on_main():
+  def work():
+    return C.on_main(threading.get_ident)
+
+  future = C.get_parse_pool().submit(work)
+  assert C.wait(future) == threading.main_thread().ident
+
+def test_prefetch(tmpdir):
+  for name, imports in [('a', 'bc'), ('b', 'ca'), ('c', 'ab'), ('main', 'abc')]:
+    src = ''.join('import {}\n'.format(imp) for imp in imports) + '\nvar x = 1\n'
+    tmpdir.join(name + '.rn').write(src)
+
+  C.reset_compilers()
+  jobs, C.Compiler.jobs = C.Compiler.jobs, 4
+  try:
+    main = C.get_compiler(str(tmpdir.join('main.rn')), main=True)
+    main.parse()
+    assert main.macros == {}
+
+    for comp in list(C.compilers.values()):
+      comp.parse()
+      assert comp.ast is not None
+
+  finally:
+    C.Compiler.jobs = jobs
+    C.reset_compilers()